@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'loans.instrumentation.PerformanceMiddleware',
+    'loans.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,12 +78,67 @@ WSGI_APPLICATION = 'compassway.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE selects the backend: 'sqlite' (default) or 'postgresql'.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'compassway'),
+            'USER': os.environ.get('POSTGRES_USER', 'compassway'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get('DB_POOL', '0') == '1':
+        # psycopg connection pool; persistent connections must stay disabled.
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+            },
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+    if os.environ.get('SQLITE_WAL', '0') == '1':
+        # WAL lets readers proceed during a write; IMMEDIATE takes the write
+        # lock at BEGIN so concurrent adjustments queue instead of failing.
+        DATABASES['default']['OPTIONS'] = {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+        }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Redis when REDIS_URL is set (see docker-compose.yml), local memory otherwise.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
 
 
 # Password validation
@@ -123,3 +181,42 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Loans
+
+# Number of loans inserted per chunk by the bulk creation endpoint.
+LOANS_BULK_BATCH_SIZE = 1000
+
+# How new loans store their schedule: 'rows' (one Payment row per payment)
+# or 'packed' (a single PackedSchedule row); a request may override it.
+LOANS_SCHEDULE_STORAGE = os.environ.get('LOANS_SCHEDULE_STORAGE', 'rows')
+
+# Optimistic concurrency for payment adjustments: attempts before answering
+# 409, and the base backoff in seconds (doubled after every conflict).
+LOANS_ADJUST_ATTEMPTS = 5
+LOANS_ADJUST_BACKOFF = 0.01
+
+# Number of distinct schedule quotes kept in the in-process LRU cache.
+LOANS_QUOTE_CACHE_SIZE = 1024
+
+# Seconds a rendered schedule stays in the cache; writes invalidate it earlier.
+LOANS_SCHEDULE_CACHE_TIMEOUT = 60 * 60
+
+# Server-Timing headers and the /metrics endpoint; the middleware removes
+# itself when this is off.
+LOANS_INSTRUMENTATION = os.environ.get('LOANS_INSTRUMENTATION', '0') == '1'
+
+# gzip (or Brotli, with the brotli package) response compression for clients
+# that accept it; the middleware removes itself when this is off.
+LOANS_COMPRESSION = os.environ.get('LOANS_COMPRESSION', '1') == '1'
+
+# Schedules with more payments than this are built and recalculated by a
+# background job (202 + job id); None keeps everything in the request.
+LOANS_ASYNC_JOB_THRESHOLD = None
+
+# 'redis' queues jobs for `manage.py run_jobs`; 'inprocess' runs them at once.
+LOANS_JOB_BACKEND = 'redis' if REDIS_URL else 'inprocess'
+
+# Seconds job state and results are kept in the cache.
+LOANS_JOB_TTL = 24 * 60 * 60
@@ -0,0 +1,138 @@
+"""Async counterparts of the loan endpoints for ASGI deployments.
+
+Validation reuses the DRF serializers and the cache is used through its
+async API, while reads that need a transaction and the writes in
+``loans.services`` run through ``sync_to_async``. Responses have the same JSON shape as the DRF
+views.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.views import View
+from rest_framework.exceptions import APIException
+
+from .cache import aget_cached_schedule, aset_cached_schedule, etag_matches
+from .jobs import accepted_data, enqueue, needs_job
+from .models import Loan, Payment
+from .renderers import SCHEDULE_VERSION_HEADER, render_schedule_json, schedule_delta_data
+from .serializers import LoanCreateSerializer, PaymentAdjustmentSerializer
+from .services import (
+    apply_reduction,
+    create_loan,
+    get_payment,
+    read_schedule,
+    schedule_tuples,
+)
+
+
+def parse_json_body(request):
+    try:
+        return json.loads(request.body or b"{}"), None
+    except ValueError as exc:
+        return None, JsonResponse({"detail": f"JSON parse error - {exc}"}, status=400)
+
+
+def api_error(exc: APIException) -> JsonResponse:
+    """Render a DRF exception the way DRF's exception handler does."""
+
+    detail = exc.detail if isinstance(exc.detail, (dict, list)) else {"detail": exc.detail}
+    return JsonResponse(detail, status=exc.status_code, safe=False)
+
+
+def not_found(detail: str) -> JsonResponse:
+    return JsonResponse({"detail": detail}, status=404)
+
+
+async def job_response(request, kind: str, payload: dict) -> JsonResponse:
+    """Enqueue a background job and answer ``202`` as the DRF views do."""
+
+    job = await sync_to_async(enqueue)(kind, payload)
+    data = accepted_data(request, job)
+    response = JsonResponse(data, status=202)
+    response["Location"] = data["status_url"]
+    return response
+
+
+class AsyncLoanScheduleCreateView(View):
+    http_method_names = ["post"]
+
+    async def post(self, request, *args, **kwargs):
+        data, error = parse_json_body(request)
+        if error:
+            return error
+        serializer = LoanCreateSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        if needs_job(serializer.validated_data["number_of_payments"]):
+            return await job_response(request, "create_loan", data)
+
+        loan, payments = await sync_to_async(create_loan)(serializer.validated_data)
+        body = render_schedule_json(loan.pk, schedule_tuples(payments))
+        response = HttpResponse(body, content_type="application/json", status=201)
+        response[SCHEDULE_VERSION_HEADER] = str(loan.version)
+        return response
+
+
+class AsyncPaymentAdjustmentView(View):
+    http_method_names = ["post"]
+
+    async def post(self, request, loan_id: int, sequence: int, *args, **kwargs):
+        try:
+            payment = await sync_to_async(get_payment)(loan_id, sequence)
+        except Payment.DoesNotExist:
+            return not_found("Payment not found for provided identifiers")
+
+        data, error = parse_json_body(request)
+        if error:
+            return error
+        serializer = PaymentAdjustmentSerializer(data=data, context={"payment": payment})
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        reduction = serializer.validated_data["reduction"]
+        if needs_job(payment.loan.number_of_payments):
+            return await job_response(
+                request,
+                "adjust_payment",
+                {"loan_id": loan_id, "sequence": sequence, "reduction": str(reduction)},
+            )
+
+        try:
+            update = await sync_to_async(apply_reduction)(payment, reduction)
+        except APIException as exc:
+            return api_error(exc)
+        if serializer.validated_data.get("since_version") == update.base_version:
+            response = JsonResponse(schedule_delta_data(update))
+        else:
+            response = HttpResponse(
+                render_schedule_json(payment.loan_id, update.rows),
+                content_type="application/json",
+            )
+        response[SCHEDULE_VERSION_HEADER] = str(update.version)
+        return response
+
+
+class AsyncLoanScheduleView(View):
+    http_method_names = ["get"]
+
+    async def get(self, request, loan_id: int, *args, **kwargs):
+        cached = await aget_cached_schedule(loan_id)
+        if cached is None:
+            try:
+                loan, rows = await sync_to_async(read_schedule)(loan_id)
+            except Loan.DoesNotExist:
+                return not_found("Loan not found.")
+            body = render_schedule_json(loan_id, rows)
+            version = loan.version
+            etag = await aset_cached_schedule(loan_id, body, version)
+        else:
+            etag, body, version = cached
+
+        if etag_matches(etag, request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        response[SCHEDULE_VERSION_HEADER] = str(version)
+        return response
@@ -0,0 +1,211 @@
+"""Micro-benchmarks and a load driver for the loan API.
+
+Used by the ``benchmark`` management command. Each micro-benchmark times one
+service-level operation for a given schedule size; the load driver issues
+real HTTP requests, either through the Django test client (which also lets
+us count queries) or against a running server. Results are plain dicts so
+they can be stored as JSON baselines and compared later.
+"""
+
+import json
+import statistics
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import engine
+from .models import Payment
+from .serializers import serialize_schedule
+from .services import adjust_payment, create_loan, iter_schedule
+
+PERIODICITY = "1d"
+
+
+def loan_payload(size: int) -> dict:
+    return {
+        "amount": "100000",
+        "loan_start_date": "2024-01-10",
+        "number_of_payments": size,
+        "periodicity": PERIODICITY,
+        "interest_rate": "0.12",
+    }
+
+
+def loan_data(size: int) -> dict:
+    return {
+        "amount": Decimal("100000"),
+        "loan_start_date": date(2024, 1, 10),
+        "number_of_payments": size,
+        "periodicity": PERIODICITY,
+        "interest_rate": Decimal("0.12"),
+    }
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings_ms) -> dict:
+    return {
+        "min_ms": round(min(timings_ms), 3),
+        "p50_ms": round(percentile(timings_ms, 50), 3),
+        "p95_ms": round(percentile(timings_ms, 95), 3),
+        "p99_ms": round(percentile(timings_ms, 99), 3),
+        "mean_ms": round(statistics.fmean(timings_ms), 3),
+    }
+
+
+def time_calls(func, repeat: int, setup=None) -> dict:
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        func(argument)
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+
+def peak_memory_kb(func) -> float:
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def micro_benchmarks(size: int, repeat: int) -> dict:
+    """Time the schedule math, persistence, recalculation and serialization."""
+
+    data = loan_data(size)
+    periodicity = engine.get_periodicity(PERIODICITY)
+    rate = data["interest_rate"] * periodicity.year_fraction
+    loan, _ = create_loan(data)
+    rows = list(iter_schedule(loan))
+
+    def generate(_):
+        engine.generate_schedule(
+            data["amount"], rate, size, data["loan_start_date"], periodicity
+        )
+
+    def adjust(payment):
+        adjust_payment(payment, Decimal("0.01"))
+
+    def first_payment():
+        return Payment.objects.select_related("loan").get(loan=loan, sequence=1)
+
+    return {
+        "generate_schedule": time_calls(generate, repeat),
+        "create_loan": time_calls(lambda _: create_loan(data), repeat),
+        "adjust_payment": time_calls(adjust, repeat, setup=first_payment),
+        "serialize_schedule": time_calls(lambda _: serialize_schedule(rows), repeat),
+    }
+
+
+def client_load(size: int, requests: int) -> dict:
+    """Drive ``loan-create`` and ``payment-reduce`` through the test client."""
+
+    client = Client()
+    payload = json.dumps(loan_payload(size))
+    results = {}
+
+    def create():
+        return client.post(reverse("loan-create"), payload, content_type="application/json")
+
+    loan_id = create().json()["loan_id"]
+    reduce_url = reverse("payment-reduce", args=[loan_id, 1])
+
+    def reduce():
+        return client.post(reduce_url, '{"reduction": "0.01"}', content_type="application/json")
+
+    for name, request in (("loan-create", create), ("payment-reduce", reduce)):
+        timings, queries, sizes = [], [], []
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+            sizes.append(len(response.content))
+        results[name] = dict(
+            summarize(timings),
+            queries_per_request=max(queries),
+            response_bytes=max(sizes),
+            peak_memory_kb=peak_memory_kb(request),
+        )
+    return results
+
+
+def http_load(base_url: str, size: int, requests: int, concurrency: int) -> dict:
+    """Drive ``loan-create`` and ``payment-reduce`` against a running server."""
+
+    base_url = base_url.rstrip("/")
+    payload = json.dumps(loan_payload(size)).encode()
+
+    def post(path: str, body: bytes):
+        request = urllib.request.Request(
+            base_url + path, data=body, headers={"Content-Type": "application/json"}
+        )
+        started = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            content = response.read()
+        return (time.perf_counter() - started) * 1000, content
+
+    _, content = post(reverse("loan-create"), payload)
+    loan_id = json.loads(content)["loan_id"]
+    calls = {
+        "loan-create": (reverse("loan-create"), payload),
+        "payment-reduce": (
+            reverse("payment-reduce", args=[loan_id, 1]),
+            b'{"reduction": "0.01"}',
+        ),
+    }
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for name, (path, body) in calls.items():
+            started = time.perf_counter()
+            responses = list(executor.map(lambda _: post(path, body), range(requests)))
+            elapsed = time.perf_counter() - started
+            results[name] = dict(
+                summarize([timing for timing, _ in responses]),
+                requests_per_second=round(requests / elapsed, 1),
+                response_bytes=max(len(content) for _, content in responses),
+            )
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return human-readable regressions of ``results`` against ``baseline``.
+
+    Latencies regress when the median grows by more than ``tolerance``
+    (a fraction); query counts regress on any increase.
+    """
+
+    regressions = []
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            if key not in previous:
+                continue
+            old = previous[key]
+            if isinstance(value, dict):
+                walk(value, old, path + [key])
+            elif key == "p50_ms" and value > old * (1 + tolerance):
+                regressions.append(f"{'/'.join(path)}: p50 {old}ms -> {value}ms")
+            elif key == "queries_per_request" and value > old:
+                regressions.append(f"{'/'.join(path)}: queries {old} -> {value}")
+
+    walk(results, baseline, [])
+    return regressions
@@ -0,0 +1,86 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import parse_etags
+
+from .models import Loan
+
+
+# Formats a rendered schedule is cached in (see loans.renderers).
+SCHEDULE_FORMATS = ("json", "columnar", "msgpack")
+
+
+def schedule_cache_key(loan_id: int, schedule_format: str = "json") -> str:
+    if schedule_format == "json":
+        return f"loans:schedule:{loan_id}"
+    return f"loans:schedule:{loan_id}:{schedule_format}"
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.md5(body, usedforsecurity=False).hexdigest()
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """Weakly compare ``etag`` with an ``If-None-Match`` header, as Django does."""
+
+    etags = parse_etags(if_none_match)
+    if "*" in etags:
+        return True
+    target = etag.removeprefix("W/")
+    return any(candidate.removeprefix("W/") == target for candidate in etags)
+
+
+def get_cached_schedule(loan_id: int, schedule_format: str = "json"):
+    """Return ``(etag, body, version)`` for a rendered schedule, or ``None`` on a miss."""
+
+    return cache.get(schedule_cache_key(loan_id, schedule_format))
+
+
+def set_cached_schedule(
+    loan_id: int, body: bytes, version: int, schedule_format: str = "json"
+) -> str:
+    """Cache a schedule rendered at ``version``; returns its ETag.
+
+    A write committed after the schedule was read may already have cleared
+    the key, so the entry is dropped again unless ``version`` is still current.
+    """
+
+    etag = make_etag(body)
+    key = schedule_cache_key(loan_id, schedule_format)
+    cache.set(key, (etag, body, version), timeout=settings.LOANS_SCHEDULE_CACHE_TIMEOUT)
+    if not Loan.objects.filter(pk=loan_id, version=version).exists():
+        cache.delete(key)
+    return etag
+
+
+async def aget_cached_schedule(loan_id: int):
+    return await cache.aget(schedule_cache_key(loan_id))
+
+
+async def aset_cached_schedule(loan_id: int, body: bytes, version: int) -> str:
+    etag = make_etag(body)
+    key = schedule_cache_key(loan_id)
+    await cache.aset(key, (etag, body, version), timeout=settings.LOANS_SCHEDULE_CACHE_TIMEOUT)
+    if not await Loan.objects.filter(pk=loan_id, version=version).aexists():
+        await cache.adelete(key)
+    return etag
+
+
+def invalidate_schedules(*loan_ids: int) -> None:
+    """Drop cached schedules now and again once the transaction commits.
+
+    The second delete removes entries a concurrent reader may have filled
+    from the pre-commit state in the meantime.
+    """
+
+    keys = [
+        schedule_cache_key(loan_id, schedule_format)
+        for loan_id in loan_ids
+        for schedule_format in SCHEDULE_FORMATS
+    ]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
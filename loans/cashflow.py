@@ -0,0 +1,165 @@
+"""Portfolio cash flow: expected principal and interest due per day.
+
+``CashflowDay`` holds one row per due date with totals over every loan.
+Schedule writes never rescan it: they collect per-day deltas in cents — the
+whole schedule for a new loan, ``new - old`` of the rewritten rows for an
+adjustment — and :func:`apply_deltas` adds them with one upsert per batch in
+the same transaction. Queries therefore cost one row per day (or one group
+per month), however many payments there are. :func:`rebuild` recomputes the
+table from the schedules if it ever drifts, e.g. after edits in the admin.
+"""
+
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth
+
+from . import engine, packed
+from .models import CashflowDay, Loan, PackedSchedule, Payment
+
+BUCKETS = ("day", "month")
+
+Deltas = Dict[date, List[int]]
+
+
+def new_deltas() -> Deltas:
+    return defaultdict(lambda: [0, 0])
+
+
+def add_rows(deltas: Deltas, rows, sign: int = 1) -> Deltas:
+    """Add (or with ``sign=-1`` remove) whole payments or schedule rows."""
+
+    to_cents = engine.to_cents
+    for row in rows:
+        totals = deltas[row.due_date]
+        totals[0] += sign * to_cents(row.principal)
+        totals[1] += sign * to_cents(row.interest)
+    return deltas
+
+
+def add_columns(
+    deltas: Deltas, due_dates: Iterable[date], principals: Iterable[int], interests: Iterable[int]
+) -> Deltas:
+    """Add a schedule given as cent columns, e.g. from ``engine.schedule_cents``."""
+
+    for day, principal, interest in zip(due_dates, principals, interests):
+        totals = deltas[day]
+        totals[0] += principal
+        totals[1] += interest
+    return deltas
+
+
+def snapshot(rows) -> Dict[int, Tuple[int, int]]:
+    """Remember principal and interest cents by sequence before rows are recalculated."""
+
+    to_cents = engine.to_cents
+    return {row.sequence: (to_cents(row.principal), to_cents(row.interest)) for row in rows}
+
+
+def add_changes(deltas: Deltas, changed, before: Dict[int, Tuple[int, int]]) -> Deltas:
+    """Add the difference between recalculated rows and their :func:`snapshot`."""
+
+    to_cents = engine.to_cents
+    for row in changed:
+        principal, interest = before[row.sequence]
+        totals = deltas[row.due_date]
+        totals[0] += to_cents(row.principal) - principal
+        totals[1] += to_cents(row.interest) - interest
+    return deltas
+
+
+def supports_upsert() -> bool:
+    return connection.vendor in ("sqlite", "postgresql")
+
+
+def apply_deltas(deltas: Deltas) -> None:
+    """Add per-day deltas to the rollup; call inside the writing transaction."""
+
+    entries = [
+        (day, principal, interest)
+        for day, (principal, interest) in sorted(deltas.items())
+        if principal or interest
+    ]
+    if not entries:
+        return
+    if not supports_upsert():
+        for day, principal, interest in entries:
+            updated = CashflowDay.objects.filter(day=day).update(
+                principal_cents=F("principal_cents") + principal,
+                interest_cents=F("interest_cents") + interest,
+            )
+            if not updated:
+                CashflowDay.objects.create(
+                    day=day, principal_cents=principal, interest_cents=interest
+                )
+        return
+
+    quote = connection.ops.quote_name
+    table = quote(CashflowDay._meta.db_table)
+    columns = [
+        CashflowDay._meta.get_field(name).column
+        for name in ("day", "principal_cents", "interest_cents")
+    ]
+    increments = ", ".join(
+        f"{quote(column)} = {table}.{quote(column)} + excluded.{quote(column)}"
+        for column in columns[1:]
+    )
+    batch_size = connection.ops.bulk_batch_size(columns, entries)
+    with connection.cursor() as cursor:
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(quote(column) for column in columns)}) "
+                f"VALUES {', '.join(['(%s, %s, %s)'] * len(batch))} "
+                f"ON CONFLICT ({quote(columns[0])}) DO UPDATE SET {increments}",
+                [value for entry in batch for value in entry],
+            )
+
+
+def cashflow(start: date, end: date, bucket: str = "day") -> List[Tuple[date, int, int]]:
+    """Return ``(period_start, principal_cents, interest_cents)`` between two dates."""
+
+    days = CashflowDay.objects.filter(day__range=(start, end))
+    if bucket == "day":
+        return list(
+            days.order_by("day").values_list("day", "principal_cents", "interest_cents")
+        )
+    return list(
+        days.annotate(period=TruncMonth("day"))
+        .values("period")
+        .annotate(principal=Sum("principal_cents"), interest=Sum("interest_cents"))
+        .order_by("period")
+        .values_list("period", "principal", "interest")
+    )
+
+
+def rebuild() -> int:
+    """Recompute the whole rollup from the stored schedules; returns the number of days."""
+
+    deltas = new_deltas()
+    totals = (
+        Payment.objects.values("due_date")
+        .annotate(principal=Sum("principal"), interest=Sum("interest"))
+        .values_list("due_date", "principal", "interest")
+    )
+    for day, principal, interest in totals.iterator():
+        deltas[day][0] += engine.to_cents(principal)
+        deltas[day][1] += engine.to_cents(interest)
+
+    schedules = PackedSchedule.objects.select_related("loan").filter(
+        loan__storage=Loan.STORAGE_PACKED
+    )
+    for schedule in schedules.iterator(chunk_size=500):
+        loan = schedule.loan
+        rows = packed.unpack_rows(
+            schedule.data, loan.loan_start_date, engine.get_periodicity(loan.periodicity)
+        )
+        add_rows(deltas, rows)
+
+    with transaction.atomic():
+        CashflowDay.objects.all().delete()
+        apply_deltas(deltas)
+    return sum(1 for principal, interest in deltas.values() if principal or interest)
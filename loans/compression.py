@@ -0,0 +1,94 @@
+"""Response compression.
+
+:class:`CompressionMiddleware` is Django's ``GZipMiddleware`` with Brotli
+preferred for clients that send ``Accept-Encoding: br`` when the optional
+``brotli`` package is installed. Both apply to streamed NDJSON schedules as
+well. Brotli output is not padded the way ``GZipMiddleware`` pads gzip
+against BREACH, so it is limited to the API formats in
+:data:`BROTLI_CONTENT_TYPES`; HTML pages carrying CSRF tokens stay on gzip. ``LOANS_COMPRESSION=0`` removes the middleware at startup, e.g. when a
+proxy in front already compresses.
+"""
+
+import re
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+# Quality 11 (the library default) costs far more CPU than it saves bytes.
+BROTLI_QUALITY = 5
+
+# Schedule API formats, which carry no secrets next to reflected input.
+BROTLI_CONTENT_TYPES = {
+    "application/json",
+    "application/msgpack",
+    "application/vnd.loans.columnar+json",
+    "application/x-ndjson",
+}
+
+re_accepts_brotli = re.compile(r"\bbr\b")
+
+
+def compress_brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for chunk in sequence:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    def __init__(self, get_response):
+        if not settings.LOANS_COMPRESSION:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_response(self, request, response):
+        accepts_brotli = re_accepts_brotli.search(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        content_type = response.get("Content-Type", "").partition(";")[0].strip().lower()
+        if brotli is None or not accepts_brotli or content_type not in BROTLI_CONTENT_TYPES:
+            return super().process_response(request, response)
+
+        if not response.streaming and len(response.content) < 200:
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        if response.streaming:
+            if response.is_async:
+                original_iterator = response.streaming_content
+
+                async def brotli_wrapper():
+                    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+                    async for chunk in original_iterator:
+                        data = compressor.process(chunk)
+                        if data:
+                            yield data
+                    yield compressor.finish()
+
+                response.streaming_content = brotli_wrapper()
+            else:
+                response.streaming_content = compress_brotli_sequence(
+                    response.streaming_content
+                )
+            del response.headers["Content-Length"]
+        else:
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(response.content))
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
@@ -0,0 +1,409 @@
+"""Amortization math on plain values, independent of Django models.
+
+Every function here works with ``Decimal`` amounts, ``date`` objects and
+relativedelta steps, so schedules can be computed for quotes, batch jobs and
+benchmarks without touching the ORM. Per-payment arithmetic runs on integer
+cents (:func:`interest_function`, :func:`schedule_cents`); ``Decimal`` is
+only used for the EMI power, in a fixed :data:`DECIMAL_CONTEXT`, and for the
+values handed back to callers. ``recalculate_interests`` only relies on
+``sequence``/``principal``/``interest`` attributes and therefore accepts both
+:class:`ScheduleRow` and ``Payment`` instances.
+"""
+
+import calendar
+import math
+from datetime import date, timedelta
+from decimal import Context, Decimal, ROUND_HALF_EVEN, ROUND_HALF_UP, localcontext
+from functools import lru_cache
+from typing import Callable, List, Sequence, Tuple
+
+from dateutil.relativedelta import relativedelta
+
+ZERO = Decimal("0.00")
+CENT = Decimal("0.01")
+
+PERIODS_PER_YEAR = {"d": 365, "w": 52, "m": 12, "y": 1}
+STEP_KWARGS = {"d": "days", "w": "weeks", "m": "months", "y": "years"}
+
+
+# Context the schedule math has always been evaluated in (Python's default).
+DECIMAL_PRECISION = 28
+DECIMAL_CONTEXT = Context(prec=DECIMAL_PRECISION, rounding=ROUND_HALF_EVEN)
+
+_POW10 = tuple(10**k for k in range(128))
+_PRECISION_LIMIT = _POW10[DECIMAL_PRECISION]
+
+# Float estimates closer than this (relative) to a half cent are recomputed
+# exactly; balances beyond 2**53 cents always are.
+ROUNDING_TOLERANCE = 1e-9
+_FLOAT_EXACT_LIMIT = 2**53
+
+
+def quantize_money(value: Decimal) -> Decimal:
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def to_cents(value: Decimal) -> int:
+    """Convert a whole-cent amount to an integer; see :func:`is_whole_cents`."""
+
+    return int(value.scaleb(2))
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(cents) * CENT
+
+
+def is_whole_cents(value: Decimal) -> bool:
+    return value == value.quantize(CENT)
+
+
+def _pow10(k: int) -> int:
+    return _POW10[k] if k < len(_POW10) else 10**k
+
+
+def _digits(value: int) -> int:
+    """Number of decimal digits of a positive integer."""
+
+    estimate = value.bit_length() * 1233 >> 12
+    return estimate + 1 if value >= _pow10(estimate) else estimate
+
+
+def interest_function(rate_per_period: Decimal) -> Callable[[int], int]:
+    """Return ``f(balance_cents) -> interest_cents`` for one rate.
+
+    ``f(b)`` equals ``to_cents(quantize_money(from_cents(b) * rate_per_period))``
+    evaluated in :data:`DECIMAL_CONTEXT`. A float estimate decides the result
+    unless it lies within ``ROUNDING_TOLERANCE`` of a half cent; then the
+    exact integer product is rounded half-even to ``DECIMAL_PRECISION``
+    significant digits, as the ``Decimal`` multiplication does, and half-up
+    to whole cents.
+    """
+
+    sign, digits, exponent = Decimal(rate_per_period).as_tuple()
+    coefficient = int("".join(map(str, digits)))
+    if coefficient == 0:
+        return lambda balance: 0
+    if sign:
+        coefficient = -coefficient
+    rate = float(rate_per_period)
+    floor = math.floor
+
+    def interest(balance: int) -> int:
+        estimate = balance * rate
+        whole = floor(estimate)
+        fraction = estimate - whole
+        if (
+            abs(fraction - 0.5) > (abs(estimate) + 1) * ROUNDING_TOLERANCE
+            and -_FLOAT_EXACT_LIMIT < balance < _FLOAT_EXACT_LIMIT
+        ):
+            return whole + 1 if fraction > 0.5 else whole
+        return exact(balance)
+
+    def exact(balance: int) -> int:
+        product = balance * coefficient
+        magnitude = -product if product < 0 else product
+        drop = 0
+        if magnitude >= _PRECISION_LIMIT:
+            drop = _digits(magnitude) - DECIMAL_PRECISION
+            unit = _pow10(drop)
+            magnitude, remainder = divmod(magnitude, unit)
+            twice = 2 * remainder
+            if twice > unit or (twice == unit and magnitude & 1):
+                magnitude += 1
+        shift = -(exponent + drop)
+        if shift > 0:
+            unit = _pow10(shift)
+            magnitude, remainder = divmod(magnitude, unit)
+            if 2 * remainder >= unit:
+                magnitude += 1
+        elif shift < 0:
+            magnitude *= _pow10(-shift)
+        return -magnitude if product < 0 else magnitude
+
+    return interest
+
+
+class Periodicity:
+    """A parsed periodicity such as ``"2w"``.
+
+    Instances are immutable and shared: use :func:`get_periodicity` rather
+    than constructing them directly.
+    """
+
+    __slots__ = ("value", "count", "unit", "year_fraction", "step", "_day_offsets")
+
+    def __init__(self, value: str, count: int, unit: str):
+        self.value = value
+        self.count = count
+        self.unit = unit
+        if unit == "y":
+            self.year_fraction = Decimal(count)
+        else:
+            self.year_fraction = Decimal(count) / Decimal(PERIODS_PER_YEAR[unit])
+        self.step = relativedelta(**{STEP_KWARGS[unit]: count})
+        self._day_offsets = ()
+
+    def __repr__(self) -> str:
+        return f"Periodicity({self.value!r})"
+
+    def day_offsets(self, number_of_payments: int) -> tuple:
+        """Return the ``timedelta`` from the start date to each due date.
+
+        Only meaningful for day and week periodicities; the sequence is grown
+        on demand and kept for later calls.
+        """
+
+        offsets = self._day_offsets
+        if len(offsets) < number_of_payments:
+            days = self.count * (7 if self.unit == "w" else 1)
+            offsets = tuple(
+                timedelta(days=days * k) for k in range(1, number_of_payments + 1)
+            )
+            self._day_offsets = offsets
+        return offsets
+
+    def due_dates(self, start_date: date, number_of_payments: int) -> List[date]:
+        """Return the due dates of a schedule starting at ``start_date``.
+
+        Matches adding ``step`` repeatedly: for month and year steps the day
+        of month is clamped to the shortest month met so far.
+        """
+
+        if self.unit in ("d", "w"):
+            offsets = self.day_offsets(number_of_payments)
+            return [start_date + offsets[k] for k in range(number_of_payments)]
+
+        months = self.count * (12 if self.unit == "y" else 1)
+        day = start_date.day
+        base = start_date.year * 12 + start_date.month - 1
+        dates = []
+        for k in range(1, number_of_payments + 1):
+            year, month = divmod(base + months * k, 12)
+            day = min(day, calendar.monthrange(year, month + 1)[1])
+            dates.append(date(year, month + 1, day))
+        return dates
+
+
+@lru_cache(maxsize=256)
+def get_periodicity(value: str) -> Periodicity:
+    """Parse and memoize a periodicity string; raise ``ValueError`` if invalid."""
+
+    if not value or len(value) < 2:
+        raise ValueError("Invalid periodicity format.")
+    count_part, unit = value[:-1], value[-1]
+    if not count_part.isdigit() or unit not in PERIODS_PER_YEAR:
+        raise ValueError("Periodicity must follow pattern like '1d', '2w', or '3m'.")
+    count = int(count_part)
+    if count <= 0:
+        raise ValueError("Periodicity count must be positive.")
+    return Periodicity(value, count, unit)
+
+
+class ScheduleRow:
+    """One payment; ``balance`` is the outstanding principal before it."""
+
+    __slots__ = ("sequence", "due_date", "principal", "interest", "balance")
+
+    def __init__(
+        self,
+        sequence: int,
+        due_date: date,
+        principal: Decimal,
+        interest: Decimal,
+        balance: Decimal,
+    ):
+        self.sequence = sequence
+        self.due_date = due_date
+        self.principal = principal
+        self.interest = interest
+        self.balance = balance
+
+    def __repr__(self) -> str:
+        return (
+            f"ScheduleRow({self.sequence}, {self.due_date}, "
+            f"{self.principal}, {self.interest}, {self.balance})"
+        )
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ScheduleRow):
+            return NotImplemented
+        return (
+            self.sequence == other.sequence
+            and self.due_date == other.due_date
+            and self.principal == other.principal
+            and self.interest == other.interest
+            and self.balance == other.balance
+        )
+
+
+def calculate_emi(amount: Decimal, rate_per_period: Decimal, number_of_payments: int) -> Decimal:
+    """Return the equal periodic instalment for an annuity loan.
+
+    Evaluated in :data:`DECIMAL_CONTEXT` whatever the thread's context is.
+    """
+
+    P = Decimal(amount)
+    i = rate_per_period
+    n = number_of_payments
+
+    with localcontext(DECIMAL_CONTEXT):
+        if i == 0:
+            return quantize_money(P / n)
+
+        emi = i * P / (1 - (1 + i) ** Decimal(-n))
+        return quantize_money(emi)
+
+
+def schedule_cents(
+    amount_cents: int, rate_per_period: Decimal, number_of_payments: int
+) -> Tuple[List[int], List[int], List[int]]:
+    """Return the principal, interest and balance columns of a schedule in cents.
+
+    Integer counterpart of :func:`generate_schedule` without due dates.
+    """
+
+    emi = to_cents(calculate_emi(from_cents(amount_cents), rate_per_period, number_of_payments))
+    interest_of = interest_function(rate_per_period)
+    remaining = outstanding = amount_cents
+    principals, interests, balances = [], [], []
+
+    for idx in range(1, number_of_payments + 1):
+        interest = interest_of(remaining)
+        principal = remaining if idx == number_of_payments else emi - interest
+
+        principals.append(principal)
+        interests.append(interest)
+        balances.append(outstanding)
+        remaining -= principal
+        outstanding = outstanding - principal if outstanding > principal else 0
+
+    return principals, interests, balances
+
+
+def generate_schedule(
+    amount: Decimal,
+    rate_per_period: Decimal,
+    number_of_payments: int,
+    start_date: date,
+    periodicity: Periodicity,
+) -> List[ScheduleRow]:
+    """Build the full annuity schedule.
+
+    The last payment absorbs the rounding remainder so principals sum to
+    ``amount``. Balances follow the same floor-at-zero rule as
+    :func:`recalculate_interests` so a later recalculation can start from any
+    row. Whole-cent amounts go through :func:`schedule_cents`; anything else
+    uses :func:`generate_schedule_decimal`.
+    """
+
+    amount = Decimal(amount)
+    if not is_whole_cents(amount):
+        return generate_schedule_decimal(
+            amount, rate_per_period, number_of_payments, start_date, periodicity
+        )
+
+    principals, interests, balances = schedule_cents(
+        to_cents(amount), rate_per_period, number_of_payments
+    )
+    due_dates = periodicity.due_dates(start_date, number_of_payments)
+    return [
+        ScheduleRow(
+            idx + 1,
+            due_dates[idx],
+            from_cents(principals[idx]),
+            from_cents(interests[idx]),
+            from_cents(balances[idx]),
+        )
+        for idx in range(number_of_payments)
+    ]
+
+
+def generate_schedule_decimal(
+    amount: Decimal,
+    rate_per_period: Decimal,
+    number_of_payments: int,
+    start_date: date,
+    periodicity: Periodicity,
+) -> List[ScheduleRow]:
+    """Reference ``Decimal`` implementation of :func:`generate_schedule`."""
+
+    principal_remaining = Decimal(amount)
+    outstanding = principal_remaining
+    emi = calculate_emi(amount, rate_per_period, number_of_payments)
+    due_dates = periodicity.due_dates(start_date, number_of_payments)
+    rows = []
+
+    with localcontext(DECIMAL_CONTEXT):
+        for idx, current_date in enumerate(due_dates, start=1):
+            interest = quantize_money(principal_remaining * rate_per_period)
+
+            if idx == number_of_payments:
+                principal = quantize_money(principal_remaining)
+            else:
+                principal = quantize_money(emi - interest)
+
+            rows.append(ScheduleRow(idx, current_date, principal, interest, outstanding))
+            principal_remaining -= principal
+            outstanding = max(ZERO, outstanding - principal)
+
+    return rows
+
+
+def reamortize(
+    rows: Sequence,
+    outstanding: Decimal,
+    rate_per_period: Decimal,
+    start_sequence: int,
+) -> list:
+    """Re-derive balances and interests from ``start_sequence`` onward.
+
+    ``rows`` must be ordered by sequence, may be any tail of the schedule and
+    already carry their final principals; ``outstanding`` is the balance
+    before the first of them. Rows are updated in place; only the rows whose
+    interest or balance actually changed are returned.
+    """
+
+    outstanding = Decimal(outstanding)
+    changed = []
+
+    with localcontext(DECIMAL_CONTEXT):
+        for row in rows:
+            if row.sequence >= start_sequence:
+                interest = quantize_money(outstanding * rate_per_period)
+                if outstanding != row.balance or interest != row.interest:
+                    row.balance = outstanding
+                    row.interest = interest
+                    changed.append(row)
+
+            # Decrease outstanding by THIS payment's (possibly updated) principal
+            outstanding = max(ZERO, outstanding - row.principal)
+
+    return changed
+
+
+def recalculate_interests(
+    rows: Sequence,
+    outstanding: Decimal,
+    rate_per_period: Decimal,
+    changed_sequence: int,
+    reduction: Decimal,
+) -> list:
+    """Reduce the principal of ``changed_sequence`` and re-derive interests.
+
+    Arguments are as for :func:`reamortize`; the returned rows also include
+    the changed payment when its principal moved.
+    """
+
+    changed_row = None
+    for row in rows:
+        if row.sequence == changed_sequence:
+            principal = quantize_money(max(ZERO, row.principal - reduction))
+            if principal != row.principal:
+                row.principal = principal
+                changed_row = row
+            break
+
+    changed = reamortize(rows, outstanding, rate_per_period, changed_sequence)
+    if changed_row is not None and (not changed or changed[0] is not changed_row):
+        changed.insert(0, changed_row)
+    return changed
@@ -0,0 +1,213 @@
+"""Per-request performance instrumentation.
+
+When ``LOANS_INSTRUMENTATION`` is enabled, :class:`PerformanceMiddleware`
+records the number and duration of database queries, the time spent in
+named sections (``span("schedule")`` in the services, ``span("serialize")``
+in the views) and the response size of every request. Totals are sent back
+in a ``Server-Timing`` header and aggregated into in-process counters and
+histograms exposed in Prometheus text format by :func:`metrics_view`; every
+worker process keeps its own registry.
+
+When disabled the middleware removes itself at startup and ``span`` returns
+a shared no-op context manager.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+_NOOP = nullcontext()
+_current = ContextVar("loans_request_metrics", default=None)
+
+
+class RequestMetrics:
+    __slots__ = ("queries", "db_seconds", "sections")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.sections = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    """Thread-safe in-process counters and histograms keyed by label tuples."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name: str, labels: tuple, value: float = 1) -> None:
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def observe(self, name: str, labels: tuple, value: float, buckets=DURATION_BUCKETS) -> None:
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{format_labels(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    bucket_labels = labels + (("le", f"{bound:g}"),)
+                    lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+                bucket_labels = labels + (("le", "+Inf"),)
+                lines.append(f"{name}_bucket{format_labels(bucket_labels)} {histogram.count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.total:g}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+registry = Registry()
+
+
+def span(name: str):
+    """Time a named section of the current request; a no-op when not recording."""
+
+    metrics = _current.get()
+    if metrics is None:
+        return _NOOP
+    return _timed(metrics, name)
+
+
+@contextmanager
+def _timed(metrics: RequestMetrics, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.sections[name] += time.perf_counter() - started
+
+
+def add_execute_wrapper(wrapper) -> None:
+    connection.execute_wrappers.append(wrapper)
+
+
+def remove_execute_wrapper(wrapper) -> None:
+    connection.execute_wrappers.remove(wrapper)
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.LOANS_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, metrics, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        # Queries of an async request run on its thread-sensitive sync thread,
+        # so the wrapper goes on that thread's connection.
+        await sync_to_async(add_execute_wrapper)(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(remove_execute_wrapper)(metrics)
+            _current.reset(token)
+        return self.record(request, response, metrics, time.perf_counter() - started)
+
+    def record(self, request, response, metrics: RequestMetrics, total: float):
+        """Add the ``Server-Timing`` header and update the registry."""
+
+        timings = [f'db;dur={metrics.db_seconds * 1000:.2f};desc="{metrics.queries} queries"']
+        timings += [
+            f"{name};dur={seconds * 1000:.2f}" for name, seconds in metrics.sections.items()
+        ]
+        timings.append(f"total;dur={total * 1000:.2f}")
+        response["Server-Timing"] = ", ".join(timings)
+
+        match = request.resolver_match
+        endpoint = (("endpoint", match.url_name if match else "unresolved"),)
+        registry.inc("loans_requests_total", endpoint + (("status", str(response.status_code)),))
+        registry.observe("loans_request_duration_seconds", endpoint, total)
+        registry.inc("loans_db_queries_total", endpoint, metrics.queries)
+        registry.observe("loans_db_duration_seconds", endpoint, metrics.db_seconds)
+        for name, seconds in metrics.sections.items():
+            section = endpoint + (("section", name),)
+            registry.observe("loans_section_duration_seconds", section, seconds)
+        if not response.streaming:
+            registry.observe(
+                "loans_response_bytes", endpoint, len(response.content), buckets=SIZE_BUCKETS
+            )
+        return response
+
+
+def metrics_view(request):
+    if not settings.LOANS_INSTRUMENTATION:
+        raise Http404
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
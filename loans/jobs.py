@@ -0,0 +1,143 @@
+"""Background jobs for schedules too large to build inside a request.
+
+Views enqueue a job when a loan has more than ``LOANS_ASYNC_JOB_THRESHOLD``
+payments and answer ``202`` with the job id. Job state (and the resulting
+schedule) lives in the Django cache under ``loans:job:<id>`` for
+``LOANS_JOB_TTL`` seconds.
+
+Two queue backends are available through ``LOANS_JOB_BACKEND``:
+
+* ``"redis"`` pushes job ids onto a Redis list consumed by
+  ``manage.py run_jobs`` workers;
+* ``"inprocess"`` runs the job immediately in the enqueuing process, which
+  keeps tests and single-node setups free of a worker.
+"""
+
+import json
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import Payment
+from .renderers import render_schedule_json
+from .serializers import LoanCreateSerializer, PaymentAdjustmentSerializer
+from .services import adjust_payment, create_loan, get_payment, schedule_tuples
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+REDIS_QUEUE_KEY = "loans:jobs"
+
+logger = logging.getLogger(__name__)
+
+
+def job_cache_key(job_id: str) -> str:
+    return f"loans:job:{job_id}"
+
+
+def needs_job(number_of_payments: int) -> bool:
+    threshold = settings.LOANS_ASYNC_JOB_THRESHOLD
+    return threshold is not None and number_of_payments > threshold
+
+
+def accepted_data(request, job: dict) -> dict:
+    """Body of the ``202`` answer for a job; ``status_url`` also goes in ``Location``."""
+
+    status_url = request.build_absolute_uri(reverse("job-status", args=[job["id"]]))
+    return {"job_id": job["id"], "status": job["status"], "status_url": status_url}
+
+
+def get_job(job_id: str):
+    return cache.get(job_cache_key(job_id))
+
+
+def save_job(job: dict) -> None:
+    cache.set(job_cache_key(job["id"]), job, timeout=settings.LOANS_JOB_TTL)
+
+
+def run_create_loan(payload: dict):
+    serializer = LoanCreateSerializer(data=payload)
+    serializer.is_valid(raise_exception=True)
+    loan, payments = create_loan(serializer.validated_data)
+    return loan.pk, schedule_tuples(payments)
+
+
+def run_adjust_payment(payload: dict):
+    try:
+        payment = get_payment(payload["loan_id"], payload["sequence"])
+    except Payment.DoesNotExist as exc:
+        raise ValidationError("Payment not found for provided identifiers") from exc
+    serializer = PaymentAdjustmentSerializer(
+        data={"reduction": payload["reduction"]}, context={"payment": payment}
+    )
+    serializer.is_valid(raise_exception=True)
+    rows = adjust_payment(payment, serializer.validated_data["reduction"])
+    return payment.loan_id, rows
+
+
+HANDLERS = {
+    "create_loan": run_create_loan,
+    "adjust_payment": run_adjust_payment,
+}
+
+
+def run_job(job_id: str) -> dict:
+    """Execute a queued job and store its outcome."""
+
+    job = get_job(job_id)
+    if job is None or job["status"] != QUEUED:
+        return job
+    job["status"] = RUNNING
+    save_job(job)
+
+    try:
+        loan_id, rows = HANDLERS[job["kind"]](job["payload"])
+    except APIException as exc:
+        job.update(status=FAILED, errors=exc.detail)
+    except Exception:
+        logger.exception("Job %s failed", job_id)
+        job.update(status=FAILED, errors={"detail": "Internal error while running the job."})
+    else:
+        job.update(status=DONE, result=json.loads(render_schedule_json(loan_id, rows)))
+    save_job(job)
+    return job
+
+
+class InProcessQueue:
+    def push(self, job_id: str) -> None:
+        run_job(job_id)
+
+
+class RedisQueue:
+    def __init__(self, url: str):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def push(self, job_id: str) -> None:
+        self.client.lpush(REDIS_QUEUE_KEY, job_id)
+
+    def pop(self, timeout: int = 5):
+        item = self.client.brpop(REDIS_QUEUE_KEY, timeout=timeout)
+        return item[1].decode() if item else None
+
+
+def get_queue():
+    if settings.LOANS_JOB_BACKEND == "redis":
+        return RedisQueue(settings.REDIS_URL)
+    return InProcessQueue()
+
+
+def enqueue(kind: str, payload: dict) -> dict:
+    """Record a job and hand it to the configured queue; returns the job state."""
+
+    job = {"id": uuid.uuid4().hex, "kind": kind, "status": QUEUED, "payload": payload}
+    save_job(job)
+    get_queue().push(job["id"])
+    return get_job(job["id"]) or job
@@ -0,0 +1,93 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from loans import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark schedule services and the loan API across schedule sizes, "
+        "optionally comparing against or saving a JSON baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[12, 360, 3650],
+            help="Numbers of payments to benchmark.",
+        )
+        parser.add_argument("--repeat", type=int, default=20, help="Runs per micro-benchmark.")
+        parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint.")
+        parser.add_argument(
+            "--url",
+            help="Load-test a running server at this base URL instead of the test client.",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=8,
+            help="Concurrent requests when --url is given.",
+        )
+        parser.add_argument("--baseline", help="Compare results against this JSON file.")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.25,
+            help="Allowed relative p50 slowdown before reporting a regression.",
+        )
+        parser.add_argument("--save-baseline", help="Write results to this JSON file.")
+        parser.add_argument(
+            "--use-current-db", action="store_true",
+            help="Run against the configured database instead of a throwaway test database.",
+        )
+
+    def handle(self, *args, **options):
+        old_name = None
+        if not options["use_current_db"] and not options["url"]:
+            setup_test_environment()
+            old_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        self.report(results)
+
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w") as handle:
+                json.dump(results, handle, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved baseline to {options['save_baseline']}")
+
+        if options["baseline"]:
+            with open(options["baseline"]) as handle:
+                baseline = json.load(handle)
+            regressions = benchmarks.compare(results, baseline, options["tolerance"])
+            if regressions:
+                raise CommandError("Regressions found:\n" + "\n".join(regressions))
+            self.stdout.write("No regressions against baseline.")
+
+    def run(self, options):
+        results = {}
+        for size in options["sizes"]:
+            key = str(size)
+            if options["url"]:
+                results[key] = {
+                    "load": benchmarks.http_load(
+                        options["url"], size, options["requests"], options["concurrency"]
+                    )
+                }
+            else:
+                results[key] = {
+                    "micro": benchmarks.micro_benchmarks(size, options["repeat"]),
+                    "load": benchmarks.client_load(size, options["requests"]),
+                }
+        return results
+
+    def report(self, results):
+        for size, groups in results.items():
+            self.stdout.write(f"number_of_payments={size}")
+            for group, entries in groups.items():
+                for name, stats in entries.items():
+                    details = ", ".join(f"{key}={value}" for key, value in stats.items())
+                    self.stdout.write(f"  {group}/{name}: {details}")
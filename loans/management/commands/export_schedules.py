@@ -0,0 +1,69 @@
+import csv
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from loans.serializers import schedule_row_data
+from loans.services import iter_all_schedules
+
+from .import_loans import FORMATS, guess_format
+
+# loan_id followed by the keys of a schedule row in the API responses.
+FIELDS = ("loan_id", "id", "date", "principal", "interest")
+
+
+class Command(BaseCommand):
+    help = (
+        "Write every schedule to a CSV or NDJSON file, one payment per line, "
+        "streaming from the database so memory stays flat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", help="File to write ('-' for stdout); a .gz suffix compresses it."
+        )
+        parser.add_argument(
+            "--format", choices=FORMATS,
+            help="Output format; taken from the file extension when omitted.",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=2000, help="Payments fetched per round trip."
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or guess_format(path)
+
+        started = time.perf_counter()
+        rows = iter_all_schedules(chunk_size=options["chunk_size"])
+        if path == "-":
+            count = write_rows(self.stdout, rows, file_format)
+            report = self.stderr
+        else:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "wt", encoding="utf-8", newline="") as handle:
+                count = write_rows(handle, rows, file_format)
+            report = self.stdout
+
+        elapsed = time.perf_counter() - started
+        report.write(
+            f"Exported {count} payments in {elapsed:.3f}s"
+            + (f", {count / elapsed:.0f} payments/s" if elapsed and count else "")
+        )
+
+
+def write_rows(handle, rows, file_format: str) -> int:
+    writer = csv.DictWriter(handle, FIELDS) if file_format == "csv" else None
+    if writer is not None:
+        writer.writeheader()
+    count = 0
+    for loan_id, *row in rows:
+        line = {"loan_id": loan_id, **schedule_row_data(*row)}
+        if writer is not None:
+            writer.writerow(line)
+        else:
+            handle.write(json.dumps(line, separators=(",", ":")) + "\n")
+        count += 1
+    return count
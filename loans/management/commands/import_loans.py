@@ -0,0 +1,115 @@
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from loans.serializers import LoanCreateSerializer
+from loans.services import create_loans_bulk
+
+FORMATS = ("csv", "ndjson")
+
+
+class Command(BaseCommand):
+    help = (
+        "Create loans and their schedules from a CSV or NDJSON file of any size, "
+        "validating each record like POST /api/loans/."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", help="File to read ('-' for stdin); a .gz suffix is decompressed."
+        )
+        parser.add_argument(
+            "--format", choices=FORMATS,
+            help="Input format; taken from the file extension when omitted.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int,
+            help="Loans per transaction (LOANS_BULK_BATCH_SIZE by default).",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or guess_format(path)
+        batch_size = options["batch_size"] or settings.LOANS_BULK_BATCH_SIZE
+        if batch_size <= 0:
+            raise CommandError("--batch-size must be positive.")
+
+        started = time.perf_counter()
+        created = invalid = 0
+        with open_input(path) as handle:
+            valid = self.validated(read_records(handle, file_format))
+            while True:
+                batch = list(islice(valid, batch_size))
+                if not batch:
+                    break
+                created += len(create_loans_bulk(batch, batch_size))
+            invalid = self.invalid
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Imported {created} loans ({invalid} invalid records) in {elapsed:.3f}s"
+            + (f", {created / elapsed:.0f} loans/s" if elapsed and created else "")
+        )
+
+    def validated(self, records):
+        """Yield validated loan data, reporting invalid records on stderr."""
+
+        self.invalid = 0
+        for line, record, error in records:
+            if error is None:
+                serializer = LoanCreateSerializer(data=record)
+                if serializer.is_valid():
+                    yield serializer.validated_data
+                    continue
+                error = json.dumps(serializer.errors)
+            self.invalid += 1
+            self.stderr.write(f"Line {line}: {error}")
+
+
+def guess_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    raise CommandError("Cannot tell the format from the file name; pass --format.")
+
+
+def open_input(path: str):
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def read_records(handle, file_format: str):
+    """Yield ``(line, record, error)`` for every record of the input."""
+
+    if file_format == "csv":
+        reader = csv.DictReader(handle)
+        for record in reader:
+            # Empty cells mean "not given", e.g. the optional storage column.
+            record = {key: value for key, value in record.items() if value not in ("", None)}
+            yield reader.line_num, record, None
+        return
+
+    for line, text in enumerate(handle, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError as exc:
+            yield line, None, f"NDJSON parse error: {exc}"
+            continue
+        if not isinstance(record, dict):
+            yield line, None, "Expected a JSON object."
+            continue
+        yield line, record, None
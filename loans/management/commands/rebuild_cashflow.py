@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from loans import cashflow
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily cash-flow rollup from the stored schedules."
+
+    def handle(self, *args, **options):
+        days = cashflow.rebuild()
+        self.stdout.write(f"Rebuilt cash flow for {days} days.")
@@ -0,0 +1,118 @@
+import csv
+import json
+import os
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework import serializers
+
+from loans.serializers import LoanCreateSerializer
+from loans.services import reprice_loans
+
+
+class Command(BaseCommand):
+    help = (
+        "Move loans to a new interest rate and recompute their interests in "
+        "parallel worker processes, optionally resuming from a checkpoint file."
+    )
+
+    def add_arguments(self, parser):
+        rates = parser.add_mutually_exclusive_group(required=True)
+        rates.add_argument("--rate", help="New annual rate for every loan (0.12 or 12).")
+        rates.add_argument(
+            "--rates",
+            metavar="CSV",
+            help="Reprice only the loans in this loan_id,interest_rate CSV file.",
+        )
+        parser.add_argument("--chunk-size", type=int, help="Loans per chunk.")
+        parser.add_argument(
+            "--workers", type=int,
+            help="Worker processes (one per CPU by default, 1 to run in this process).",
+        )
+        parser.add_argument(
+            "--effective-date", type=date.fromisoformat, metavar="YYYY-MM-DD",
+            help="Reprice payments due on or after this date (today by default).",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="Record progress in this JSON file and resume from it if it exists.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rate"] is not None:
+            rates = self.parse_rate(options["rate"])
+            source = {"rate": str(rates)}
+        else:
+            rates = self.read_rates(options["rates"])
+            source = {"rates": os.path.abspath(options["rates"])}
+        effective_date = options["effective_date"] or timezone.localdate()
+        source["effective_date"] = effective_date.isoformat()
+
+        after = 0
+        checkpoint = options["checkpoint"]
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as handle:
+                state = json.load(handle)
+            if state["source"] != source:
+                raise CommandError(
+                    f"{checkpoint} belongs to a run with {state['source']}; "
+                    "remove it to start over."
+                )
+            after = state["last_loan_id"]
+            self.stdout.write(f"Resuming after loan {after}.")
+
+        started = time.perf_counter()
+
+        def progress(last_loan_id, totals):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"Loan {last_loan_id}: {totals['loans']} loans, {totals['repriced']} repriced, "
+                f"{totals['payments']} payments, {totals['loans'] / elapsed:.0f} loans/s"
+            )
+            if checkpoint:
+                self.save_checkpoint(checkpoint, source, last_loan_id)
+
+        totals = reprice_loans(
+            rates,
+            chunk_size=options["chunk_size"],
+            workers=options["workers"],
+            after=after,
+            progress=progress,
+            effective_date=effective_date,
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Repriced {totals['repriced']} of {totals['loans']} loans "
+            f"({totals['payments']} payments) in {elapsed:.3f}s"
+            + (f", {totals['loans'] / elapsed:.0f} loans/s" if elapsed and totals["loans"] else "")
+        )
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def parse_rate(self, value, label="--rate"):
+        field = serializers.DecimalField(max_digits=7, decimal_places=4, min_value=Decimal("0"))
+        try:
+            rate = field.run_validation(value)
+        except serializers.ValidationError as exc:
+            raise CommandError(f"{label}: {' '.join(map(str, exc.detail))}") from exc
+        return LoanCreateSerializer().validate_interest_rate(rate)
+
+    def read_rates(self, path):
+        rates = {}
+        with open(path, newline="") as handle:
+            for line, row in enumerate(csv.DictReader(handle), start=2):
+                try:
+                    loan_id = int(row["loan_id"])
+                except (KeyError, TypeError, ValueError) as exc:
+                    raise CommandError(f"{path}:{line}: invalid loan_id.") from exc
+                rates[loan_id] = self.parse_rate(row.get("interest_rate"), f"{path}:{line}")
+        return rates
+
+    def save_checkpoint(self, path, source, last_loan_id):
+        partial = path + ".tmp"
+        with open(partial, "w") as handle:
+            json.dump({"source": source, "last_loan_id": last_loan_id}, handle)
+        os.replace(partial, path)
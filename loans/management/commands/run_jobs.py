@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from loans.jobs import RedisQueue, run_job
+
+
+class Command(BaseCommand):
+    help = "Process background schedule jobs from the Redis queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--burst", action="store_true", help="Exit once the queue is empty."
+        )
+        parser.add_argument(
+            "--timeout", type=int, default=5, help="Seconds to block waiting for a job."
+        )
+
+    def handle(self, *args, **options):
+        if settings.LOANS_JOB_BACKEND != "redis":
+            raise CommandError("run_jobs needs LOANS_JOB_BACKEND = 'redis' (set REDIS_URL).")
+
+        queue = RedisQueue(settings.REDIS_URL)
+        self.stdout.write("Waiting for jobs...")
+        while True:
+            job_id = queue.pop(timeout=options["timeout"])
+            if job_id is None:
+                if options["burst"]:
+                    return
+                continue
+            job = run_job(job_id)
+            if job is not None:
+                self.stdout.write(f"Job {job_id}: {job['status']}")
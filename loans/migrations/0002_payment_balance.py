@@ -0,0 +1,30 @@
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_balances(apps, schema_editor):
+    Loan = apps.get_model('loans', 'Loan')
+    Payment = apps.get_model('loans', 'Payment')
+    for loan in Loan.objects.iterator():
+        outstanding = loan.amount
+        payments = list(Payment.objects.filter(loan=loan).order_by('sequence'))
+        for payment in payments:
+            payment.balance = outstanding
+            outstanding = max(Decimal('0.00'), outstanding - payment.principal)
+        Payment.objects.bulk_update(payments, ['balance'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0003_payment_due_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedSchedule',
+            fields=[
+                ('loan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='packed_schedule', serialize=False, to='loans.loan')),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='storage',
+            field=models.CharField(choices=[('rows', 'One Payment row per payment'), ('packed', 'Single PackedSchedule row')], default='rows', max_length=10),
+        ),
+    ]
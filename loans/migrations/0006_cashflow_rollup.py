@@ -0,0 +1,70 @@
+import struct
+from collections import defaultdict
+
+from dateutil.relativedelta import relativedelta
+from django.db import migrations, models
+from django.db.models import Sum
+
+STEP_KWARGS = {'d': 'days', 'w': 'weeks', 'm': 'months', 'y': 'years'}
+
+
+def to_cents(value):
+    return int(value.scaleb(2))
+
+
+def backfill_cashflow(apps, schema_editor):
+    CashflowDay = apps.get_model('loans', 'CashflowDay')
+    Payment = apps.get_model('loans', 'Payment')
+    PackedSchedule = apps.get_model('loans', 'PackedSchedule')
+    totals = defaultdict(lambda: [0, 0])
+
+    days = (
+        Payment.objects.values('due_date')
+        .annotate(principal=Sum('principal'), interest=Sum('interest'))
+        .values_list('due_date', 'principal', 'interest')
+    )
+    for day, principal, interest in days:
+        totals[day][0] += to_cents(principal)
+        totals[day][1] += to_cents(interest)
+
+    # Packed data is little-endian int64 cents: all principals, then all
+    # interests, then all balances. Due dates come from stepping the start
+    # date by the periodicity.
+    for schedule in PackedSchedule.objects.select_related('loan').iterator(chunk_size=500):
+        loan = schedule.loan
+        data = bytes(schedule.data)
+        n = len(data) // 24
+        values = struct.unpack(f'<{3 * n}q', data)
+        step = relativedelta(**{STEP_KWARGS[loan.periodicity[-1]]: int(loan.periodicity[:-1])})
+        due_date = loan.loan_start_date
+        for k in range(n):
+            due_date += step
+            totals[due_date][0] += values[k]
+            totals[due_date][1] += values[n + k]
+
+    CashflowDay.objects.bulk_create(
+        [
+            CashflowDay(day=day, principal_cents=principal, interest_cents=interest)
+            for day, (principal, interest) in totals.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0005_loan_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashflowDay',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('principal_cents', models.BigIntegerField(default=0)),
+                ('interest_cents', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_cashflow, migrations.RunPython.noop),
+    ]
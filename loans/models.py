@@ -3,6 +3,13 @@ from django.db import models
 
 
 class Loan(models.Model):
+    STORAGE_ROWS = "rows"
+    STORAGE_PACKED = "packed"
+    STORAGE_CHOICES = [
+        (STORAGE_ROWS, "One Payment row per payment"),
+        (STORAGE_PACKED, "Single PackedSchedule row"),
+    ]
+
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     loan_start_date = models.DateField()
     number_of_payments = models.PositiveIntegerField()
@@ -10,6 +17,9 @@ class Loan(models.Model):
     interest_rate = models.DecimalField(max_digits=5, decimal_places=4)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    storage = models.CharField(max_length=10, choices=STORAGE_CHOICES, default=STORAGE_ROWS)
+    # Bumped by every schedule write; adjustments compare-and-swap it.
+    version = models.PositiveIntegerField(default=0)
 
     def __str__(self) -> str:
         return f"Loan {self.pk}"
@@ -21,10 +31,45 @@ class Payment(models.Model):
     due_date = models.DateField()
     principal = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
     interest = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    # Outstanding principal before this payment, so recalculations can start here.
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
 
     class Meta:
         ordering = ["sequence"]
         unique_together = ("loan", "sequence")
+        indexes = [models.Index(fields=["due_date"], name="loans_payment_due_date_idx")]
 
     def __str__(self) -> str:
         return f"Payment {self.sequence} for Loan {self.loan_id}"
+
+
+class PackedSchedule(models.Model):
+    """A whole schedule in one row for loans with ``storage="packed"``.
+
+    ``data`` holds little-endian int64 cents: all principals, then all
+    interests, then all balances. Due dates are derived from the loan's start
+    date and periodicity.
+    """
+
+    loan = models.OneToOneField(
+        Loan, primary_key=True, related_name="packed_schedule", on_delete=models.CASCADE
+    )
+    data = models.BinaryField()
+
+    def __str__(self) -> str:
+        return f"Packed schedule for Loan {self.loan_id}"
+
+
+class CashflowDay(models.Model):
+    """Expected principal and interest due on one day across all loans.
+
+    Maintained incrementally by every schedule write (see ``loans.cashflow``);
+    amounts are integer cents so repeated increments stay exact.
+    """
+
+    day = models.DateField(primary_key=True)
+    principal_cents = models.BigIntegerField(default=0)
+    interest_cents = models.BigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"Cash flow on {self.day}"
@@ -0,0 +1,101 @@
+"""Binary encoding of a whole schedule for ``storage="packed"`` loans.
+
+A packed schedule is three little-endian int64 columns of cents laid out one
+after another: principals, interests, balances. Due dates are not stored;
+they are derived from the loan's start date and periodicity exactly as
+:func:`loans.engine.generate_schedule` derives them, so a schedule of ``n``
+payments costs ``24 * n`` bytes in a single row.
+"""
+
+import struct
+import sys
+from array import array
+from datetime import date
+from typing import List, Sequence, Tuple
+
+from . import engine
+
+ITEM_SIZE = 8
+COLUMNS = 3
+
+
+def pack_columns(
+    principals: Sequence[int], interests: Sequence[int], balances: Sequence[int]
+) -> bytes:
+    """Encode cent columns such as those of :func:`loans.engine.schedule_cents`."""
+
+    values = array("q", principals)
+    values.extend(interests)
+    values.extend(balances)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def pack_rows(rows: Sequence) -> bytes:
+    """Encode rows carrying ``principal``/``interest``/``balance`` amounts."""
+
+    to_cents = engine.to_cents
+    values = array("q", [to_cents(row.principal) for row in rows])
+    values.extend(to_cents(row.interest) for row in rows)
+    values.extend(to_cents(row.balance) for row in rows)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _columns(data: bytes) -> Tuple[array, int]:
+    values = array("q")
+    values.frombytes(bytes(data))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, len(values) // COLUMNS
+
+
+def unpack_columns(data: bytes) -> Tuple[List[int], List[int], List[int]]:
+    """Decode the principal, interest and balance columns as lists of cents."""
+
+    values, n = _columns(data)
+    return values[:n].tolist(), values[n:2 * n].tolist(), values[2 * n:].tolist()
+
+
+def unpack_rows(
+    data: bytes, start_date: date, periodicity: engine.Periodicity
+) -> List[engine.ScheduleRow]:
+    """Expand a packed schedule back into :class:`~loans.engine.ScheduleRow` objects."""
+
+    values, n = _columns(data)
+    due_dates = periodicity.due_dates(start_date, n)
+    from_cents = engine.from_cents
+    return [
+        engine.ScheduleRow(
+            k + 1,
+            due_dates[k],
+            from_cents(values[k]),
+            from_cents(values[n + k]),
+            from_cents(values[2 * n + k]),
+        )
+        for k in range(n)
+    ]
+
+
+def unpack_row(
+    data: bytes, start_date: date, periodicity: engine.Periodicity, sequence: int
+) -> engine.ScheduleRow:
+    """Decode a single payment; raise ``IndexError`` if ``sequence`` is out of range."""
+
+    n = len(data) // (ITEM_SIZE * COLUMNS)
+    if not 1 <= sequence <= n:
+        raise IndexError(sequence)
+    k = sequence - 1
+    principal, interest, balance = (
+        struct.unpack_from("<q", data, ITEM_SIZE * (column * n + k))[0]
+        for column in range(COLUMNS)
+    )
+    return engine.ScheduleRow(
+        sequence,
+        periodicity.due_dates(start_date, sequence)[k],
+        engine.from_cents(principal),
+        engine.from_cents(interest),
+        engine.from_cents(balance),
+    )
@@ -0,0 +1,120 @@
+import json
+from datetime import date
+from decimal import Decimal
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .serializers import columnar_schedule, schedule_row_data, serialize_schedule
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+
+# Response header carrying the loan version a schedule corresponds to.
+SCHEDULE_VERSION_HEADER = "X-Schedule-Version"
+
+
+def render_schedule_json(loan_id: int, rows) -> bytes:
+    """Render ``{"loan_id", "schedule"}`` the way the JSON API responses do."""
+
+    return JSONRenderer().render({"loan_id": loan_id, "schedule": serialize_schedule(rows)})
+
+
+def is_columnar(renderer) -> bool:
+    return getattr(renderer, "columnar", False)
+
+
+def schedule_data(rows, renderer=None):
+    """Serialize schedule rows for ``renderer``: parallel arrays or row objects."""
+
+    return columnar_schedule(rows) if is_columnar(renderer) else serialize_schedule(rows)
+
+
+def render_schedule(renderer, loan_id: int, rows) -> bytes:
+    """Render ``{"loan_id", "schedule"}`` with a columnar renderer, or as JSON."""
+
+    if is_columnar(renderer):
+        return renderer.render({"loan_id": loan_id, "schedule": columnar_schedule(rows)})
+    return render_schedule_json(loan_id, rows)
+
+
+def schedule_delta_data(update, renderer=None) -> dict:
+    """The delta form of a :class:`~loans.services.ScheduleUpdate` response."""
+
+    return {
+        "loan_id": update.loan_id,
+        "version": update.version,
+        "base_version": update.base_version,
+        "changes": schedule_data(update.changes, renderer),
+    }
+
+
+def compact_renderer_classes() -> list:
+    """Columnar JSON, and MessagePack when ``msgpack`` is installed."""
+
+    return [ColumnarJSONRenderer] + ([MessagePackRenderer] if msgpack is not None else [])
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """JSON whose schedules are parallel arrays with amounts in integer cents.
+
+    Views check ``columnar`` and build schedules with
+    :func:`~loans.serializers.columnar_schedule`; everything else renders as
+    plain JSON.
+    """
+
+    media_type = "application/vnd.loans.columnar+json"
+    format = "columnar"
+    columnar = True
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack with the same columnar schedules as :class:`ColumnarJSONRenderer`."""
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+    columnar = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=self.encode)
+
+    @staticmethod
+    def encode(value):
+        if isinstance(value, Decimal):
+            return format(value, "f")
+        if isinstance(value, date):
+            return value.isoformat()
+        raise TypeError(f"Cannot serialize {type(value).__name__} to MessagePack.")
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline-delimited JSON, one schedule row per line.
+
+    Views stream schedules themselves with :meth:`stream_rows`; ``render``
+    only handles non-schedule payloads such as validation errors.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return self.render_line(data)
+
+    def render_line(self, data) -> bytes:
+        return json.dumps(data, cls=JSONEncoder, separators=(",", ":")).encode() + b"\n"
+
+    def stream_rows(self, rows):
+        """Yield one encoded line per ``(sequence, due_date, principal, interest)`` row."""
+
+        for row in rows:
+            yield self.render_line(schedule_row_data(*row))
@@ -0,0 +1,75 @@
+"""Worker side of portfolio repricing (see :func:`loans.services.reprice_loans`).
+
+Everything here works on plain, picklable values and imports nothing from
+Django, so chunks can be handed to a ``ProcessPoolExecutor`` whatever start
+method the platform uses. Repricing keeps every principal and balance and
+recomputes each interest on its balance at the new rate, as
+:func:`loans.engine.reamortize` does for a whole schedule.
+"""
+
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from . import engine, packed
+
+# (loan_id, annual rate, periodicity, start date, packed data or None,
+#  [(payment_id, due_date, interest, balance), ...] for row-stored loans)
+LoanItem = Tuple[int, Decimal, str, date, bytes, list]
+
+# (loan_id, new packed data or None, [(payment id or sequence, new interest cents), ...])
+LoanResult = Tuple[int, bytes, List[Tuple[int, int]]]
+
+
+def rate_per_period(rate: Decimal, periodicity: str) -> Decimal:
+    return Decimal(rate) * engine.get_periodicity(periodicity).year_fraction
+
+
+def reprice_chunk(
+    items: List[LoanItem], effective_date: date
+) -> Tuple[List[LoanResult], Dict[date, int]]:
+    """Reprice the payments of a chunk of loans due on or after ``effective_date``.
+
+    Earlier payments keep the interest they were charged at the old rate.
+    Returns a result per loan that changed, listing the payments whose
+    interest moved (by payment id, or by sequence for packed loans, which
+    also get their new data), and the interest delta in cents per due date
+    for the cash-flow rollup.
+    """
+
+    results = []
+    deltas: Dict[date, int] = {}
+    for loan_id, rate, periodicity, start_date, data, payments in items:
+        interest_of = engine.interest_function(rate_per_period(rate, periodicity))
+        if data is not None:
+            principals, interests, balances = packed.unpack_columns(data)
+            due_dates = engine.get_periodicity(periodicity).due_dates(start_date, len(balances))
+            new_interests = [
+                interest_of(balance) if day >= effective_date else interest
+                for day, interest, balance in zip(due_dates, interests, balances)
+            ]
+            if new_interests == interests:
+                continue
+            changed = []
+            for sequence, (day, old, new) in enumerate(
+                zip(due_dates, interests, new_interests), start=1
+            ):
+                if new != old:
+                    changed.append((sequence, new))
+                    deltas[day] = deltas.get(day, 0) + new - old
+            data = packed.pack_columns(principals, new_interests, balances)
+            results.append((loan_id, data, changed))
+            continue
+
+        changed = []
+        for payment_id, day, interest, balance in payments:
+            if day < effective_date:
+                continue
+            old = engine.to_cents(interest)
+            new = interest_of(engine.to_cents(balance))
+            if new != old:
+                changed.append((payment_id, new))
+                deltas[day] = deltas.get(day, 0) + new - old
+        if changed:
+            results.append((loan_id, None, changed))
+    return results, deltas
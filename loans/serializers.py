@@ -2,7 +2,8 @@ from decimal import Decimal, ROUND_HALF_UP
 
 from rest_framework import serializers
 
-from .models import Payment
+from .engine import to_cents
+from .models import Loan, Payment
 from .services import parse_periodicity
 
 
@@ -15,6 +16,52 @@ class PaymentSerializer(serializers.ModelSerializer):
         fields = ["id", "date", "principal", "interest"]
 
 
+def schedule_row_data(sequence, due_date, principal, interest) -> dict:
+    """Represent one payment exactly as ``PaymentSerializer`` does."""
+
+    return {
+        "id": sequence,
+        "date": due_date.isoformat(),
+        "principal": format(principal, "f"),
+        "interest": format(interest, "f"),
+    }
+
+
+def serialize_schedule(rows) -> list:
+    """Fast path for ``PaymentSerializer(many=True).data``.
+
+    Takes ``(sequence, due_date, principal, interest)`` tuples, e.g. from
+    ``values_list``, and skips field introspection and model instantiation.
+    """
+
+    return [schedule_row_data(*row) for row in rows]
+
+
+def columnar_schedule(rows) -> dict:
+    """Represent ``(sequence, due_date, principal, interest)`` rows as parallel arrays.
+
+    Amounts become integer cents, so the compact renderers carry plain
+    numbers instead of one string per amount and no per-row key names.
+    """
+
+    ids, dates, principals, interests = [], [], [], []
+    for sequence, due_date, principal, interest in rows:
+        ids.append(sequence)
+        dates.append(due_date.isoformat())
+        principals.append(to_cents(principal))
+        interests.append(to_cents(interest))
+    return {"id": ids, "date": dates, "principal_cents": principals, "interest_cents": interests}
+
+
+def serialize_schedule_rows(rows) -> list:
+    """Same as :func:`serialize_schedule` for ``Payment`` or ``ScheduleRow`` objects."""
+
+    return [
+        schedule_row_data(row.sequence, row.due_date, row.principal, row.interest)
+        for row in rows
+    ]
+
+
 class LoanCreateSerializer(serializers.Serializer):
     amount = serializers.DecimalField(max_digits=12, decimal_places=2)
     loan_start_date = serializers.DateField(
@@ -23,6 +70,7 @@ class LoanCreateSerializer(serializers.Serializer):
     number_of_payments = serializers.IntegerField(min_value=1)
     periodicity = serializers.CharField()
     interest_rate = serializers.DecimalField(max_digits=7, decimal_places=4)
+    storage = serializers.ChoiceField(choices=Loan.STORAGE_CHOICES, required=False)
 
     def validate_periodicity(self, value: str) -> str:
         parse_periodicity(value)
@@ -42,6 +90,8 @@ class LoanCreateSerializer(serializers.Serializer):
 
 class PaymentAdjustmentSerializer(serializers.Serializer):
     reduction = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0)
+    # Schedule version the client holds; asks for only the changed rows.
+    since_version = serializers.IntegerField(min_value=0, required=False)
 
     def validate(self, attrs):
         payment: Payment = self.context["payment"]
@@ -51,3 +101,27 @@ class PaymentAdjustmentSerializer(serializers.Serializer):
                 {"reduction": "Reduction cannot exceed current principal."}
             )
         return attrs
+
+
+class PaymentReductionItemSerializer(serializers.Serializer):
+    loan_id = serializers.IntegerField(min_value=1)
+    sequence = serializers.IntegerField(min_value=1)
+    reduction = serializers.DecimalField(
+        max_digits=12, decimal_places=2, min_value=Decimal("0")
+    )
+
+
+class CashflowQuerySerializer(serializers.Serializer):
+    """Query parameters of the cash-flow endpoint: ``from``, ``to`` and ``bucket``."""
+
+    def get_fields(self):
+        return {
+            "from": serializers.DateField(),
+            "to": serializers.DateField(),
+            "bucket": serializers.ChoiceField(choices=["day", "month"], default="day"),
+        }
+
+    def validate(self, attrs):
+        if attrs["from"] > attrs["to"]:
+            raise serializers.ValidationError({"to": "Must not be earlier than 'from'."})
+        return attrs
@@ -1,95 +1,825 @@
-from decimal import Decimal, ROUND_HALF_UP
-from typing import Tuple
+import heapq
+import os
+import random
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from itertools import islice
+from typing import Iterable, List, Tuple
 
 from dateutil.relativedelta import relativedelta
-from django.db import transaction
-from rest_framework import serializers
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
 
-from .models import Payment
+from . import cashflow, engine, packed, repricing
+from .cache import invalidate_schedules
+from .engine import quantize_money
+from .instrumentation import span
+from .models import Loan, PackedSchedule, Payment
 
+PAYMENT_AMOUNT_FIELDS = ("principal", "interest", "balance")
 
-def quantize_money(value: Decimal) -> Decimal:
-    return value.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
 
-
-def parse_periodicity(value: str) -> Tuple[int, str]:
-    if not value or len(value) < 2:
-        raise serializers.ValidationError("Invalid periodicity format.")
-    count_part, unit = value[:-1], value[-1]
-    if not count_part.isdigit() or unit not in {"d", "w", "m", "y"}:
-        raise serializers.ValidationError(
-            "Periodicity must follow pattern like '1d', '2w', or '3m'."
-        )
-    count = int(count_part)
-    if count <= 0:
-        raise serializers.ValidationError("Periodicity count must be positive.")
-    return count, unit
+def parse_periodicity(value: str) -> engine.Periodicity:
+    try:
+        return engine.get_periodicity(value)
+    except ValueError as exc:
+        raise serializers.ValidationError(str(exc)) from exc
 
 
 def get_period_length(value: str) -> Decimal:
     """Return the fraction of a year represented by the periodicity value."""
 
-    count, unit = parse_periodicity(value)
-    count = Decimal(count)
+    return parse_periodicity(value).year_fraction
+
+
+def next_due_date(periodicity: str) -> relativedelta:
+    return parse_periodicity(periodicity).step
+
+
+def get_rate_per_period(loan: Loan) -> Decimal:
+    return Decimal(loan.interest_rate) * parse_periodicity(loan.periodicity).year_fraction
+
+
+def calculate_emi(loan: Loan) -> Decimal:
+    return engine.calculate_emi(
+        loan.amount, get_rate_per_period(loan), loan.number_of_payments
+    )
+
+
+def build_schedule(loan: Loan) -> List[engine.ScheduleRow]:
+    with span("schedule"):
+        return engine.generate_schedule(
+            loan.amount,
+            get_rate_per_period(loan),
+            loan.number_of_payments,
+            loan.loan_start_date,
+            parse_periodicity(loan.periodicity),
+        )
+
+
+def build_payments(loan: Loan) -> List[Payment]:
+    """Build the unsaved payment schedule for a loan."""
+
+    rows = build_schedule(loan)
+    return [
+        Payment(
+            loan=loan,
+            sequence=row.sequence,
+            due_date=row.due_date,
+            principal=row.principal,
+            interest=row.interest,
+            balance=row.balance,
+        )
+        for row in rows
+    ]
+
+
+@lru_cache(maxsize=settings.LOANS_QUOTE_CACHE_SIZE)
+def quote_schedule(
+    amount: Decimal,
+    interest_rate: Decimal,
+    periodicity: str,
+    number_of_payments: int,
+    loan_start_date: date,
+) -> Tuple[engine.ScheduleRow, ...]:
+    """Compute a schedule in memory without persisting anything.
+
+    Results are memoized, so the returned rows are shared between callers and
+    must not be mutated.
+    """
+
+    parsed = parse_periodicity(periodicity)
+    rate_per_period = Decimal(interest_rate) * parsed.year_fraction
+    return tuple(
+        engine.generate_schedule(
+            amount, rate_per_period, number_of_payments, loan_start_date, parsed
+        )
+    )
+
+
+def schedule_columns(loan: Loan) -> Tuple[List[int], List[int], List[int]]:
+    """Compute a loan's principal, interest and balance columns in cents."""
+
+    with span("schedule"):
+        return engine.schedule_cents(
+            engine.to_cents(loan.amount), get_rate_per_period(loan), loan.number_of_payments
+        )
+
+
+def due_dates(loan: Loan) -> List[date]:
+    return parse_periodicity(loan.periodicity).due_dates(
+        loan.loan_start_date, loan.number_of_payments
+    )
+
+
+def build_packed_schedule(loan: Loan, rows=None, columns=None) -> PackedSchedule:
+    """Pack ``rows`` or cent ``columns``, computing the columns when neither is given."""
+
+    if rows is not None:
+        return PackedSchedule(loan=loan, data=packed.pack_rows(rows))
+    if columns is None:
+        columns = schedule_columns(loan)
+    return PackedSchedule(loan=loan, data=packed.pack_columns(*columns))
+
+
+def unpack_schedule(loan: Loan, data: bytes) -> List[engine.ScheduleRow]:
+    return packed.unpack_rows(data, loan.loan_start_date, parse_periodicity(loan.periodicity))
+
+
+def iter_schedule(loan: Loan, chunk_size: int = 2000):
+    """Iterate ``(sequence, due_date, principal, interest)`` tuples from the database.
+
+    Row-stored schedules use a server-side cursor where the backend supports
+    it so memory stays flat however long the schedule is; packed schedules
+    are read as one row and expanded.
+    """
+
+    if loan.storage == Loan.STORAGE_PACKED:
+        data = PackedSchedule.objects.values_list("data", flat=True).get(loan=loan)
+        return iter(schedule_tuples(unpack_schedule(loan, data)))
+    return (
+        Payment.objects.filter(loan=loan)
+        .order_by("sequence")
+        .values_list("sequence", "due_date", "principal", "interest")
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def read_schedule(loan_id: int) -> Tuple[Loan, List[tuple]]:
+    """Read a loan and its schedule tuples in one transaction, so they agree on ``version``."""
+
+    with transaction.atomic():
+        loan = Loan.objects.get(pk=loan_id)
+        return loan, list(iter_schedule(loan))
+
+
+def schedule_tuples(payments) -> List[tuple]:
+    """Convert payment objects to ``(sequence, due_date, principal, interest)`` tuples."""
+
+    return [
+        (payment.sequence, payment.due_date, payment.principal, payment.interest)
+        for payment in payments
+    ]
+
+
+def new_loan(data: dict) -> Loan:
+    """Build an unsaved loan, defaulting its storage to ``LOANS_SCHEDULE_STORAGE``."""
+
+    return Loan(**{"storage": settings.LOANS_SCHEDULE_STORAGE, **data})
+
+
+def create_loan(data: dict) -> Tuple[Loan, list]:
+    """Create a loan with its schedule and return both.
+
+    The returned payments are the instances that were just inserted (or, for
+    packed storage, the rows that were packed), so callers do not need to
+    query the schedule back.
+    """
+
+    with transaction.atomic():
+        loan = new_loan(data)
+        loan.save(force_insert=True)
+        if loan.storage == Loan.STORAGE_PACKED:
+            payments = build_schedule(loan)
+            build_packed_schedule(loan, payments).save(force_insert=True)
+        else:
+            payments = Payment.objects.bulk_create(build_payments(loan))
+        cashflow.apply_deltas(cashflow.add_rows(cashflow.new_deltas(), payments))
+        invalidate_schedules(loan.pk)
+    return loan, payments
+
+
+def create_loans_bulk(items: Iterable[dict], batch_size: int = None) -> List[Loan]:
+    """Create many loans and their schedules with chunked bulk inserts.
+
+    Loans are inserted ``batch_size`` at a time and the payments of each chunk
+    follow in a single ``bulk_create`` (``COPY`` on PostgreSQL, see
+    :func:`insert_payments`), so the number of queries depends on the number
+    of chunks rather than on the number of loans.
+    """
+
+    batch_size = batch_size or settings.LOANS_BULK_BATCH_SIZE
+    items = iter(items)
+    created = []
+    with transaction.atomic():
+        while True:
+            chunk = [new_loan(data) for data in islice(items, batch_size)]
+            if not chunk:
+                break
+            Loan.objects.bulk_create(chunk)
+            payments = []
+            schedules = []
+            deltas = cashflow.new_deltas()
+            for loan in chunk:
+                if loan.storage == Loan.STORAGE_PACKED:
+                    columns = schedule_columns(loan)
+                    schedules.append(build_packed_schedule(loan, columns=columns))
+                    cashflow.add_columns(deltas, due_dates(loan), columns[0], columns[1])
+                else:
+                    payments.extend(build_payments(loan))
+            insert_payments(payments)
+            PackedSchedule.objects.bulk_create(schedules)
+            cashflow.apply_deltas(cashflow.add_rows(deltas, payments))
+            invalidate_schedules(*(loan.pk for loan in chunk))
+            created.extend(chunk)
+    return created
+
+
+def supports_copy() -> bool:
+    if connection.vendor != "postgresql":
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+    return is_psycopg3
+
+
+def insert_payments(payments: List[Payment]) -> None:
+    """Insert new payments without reading their ids back.
+
+    PostgreSQL with psycopg 3 streams them through ``COPY ... FROM STDIN``;
+    other backends use ``bulk_create``.
+    """
+
+    if not payments:
+        return
+    if not supports_copy():
+        Payment.objects.bulk_create(payments)
+        return
+
+    quote = connection.ops.quote_name
+    columns = ", ".join(
+        quote(Payment._meta.get_field(name).column)
+        for name in ("loan", "sequence", "due_date", "principal", "interest", "balance")
+    )
+    with connection.cursor() as cursor:
+        copy_sql = f"COPY {quote(Payment._meta.db_table)} ({columns}) FROM STDIN"
+        with cursor.cursor.copy(copy_sql) as copy:
+            for payment in payments:
+                copy.write_row(
+                    (
+                        payment.loan_id,
+                        payment.sequence,
+                        payment.due_date,
+                        payment.principal,
+                        payment.interest,
+                        payment.balance,
+                    )
+                )
+
+
+def iter_all_schedules(chunk_size: int = 2000, packed_chunk_size: int = 20):
+    """Iterate ``(loan_id, sequence, due_date, principal, interest)`` over every loan.
+
+    Rows come ordered by loan and sequence: payments are read through a
+    server-side cursor where the backend supports it and merged with packed
+    schedules, which are fetched ``packed_chunk_size`` at a time and expanded
+    one by one, so memory does not grow with the portfolio.
+    """
+
+    payments = (
+        Payment.objects.order_by("loan_id", "sequence")
+        .values_list("loan_id", "sequence", "due_date", "principal", "interest")
+        .iterator(chunk_size=chunk_size)
+    )
+    schedules = (
+        PackedSchedule.objects.order_by("loan_id")
+        .values_list("loan_id", "loan__loan_start_date", "loan__periodicity", "data")
+        .iterator(chunk_size=packed_chunk_size)
+    )
+    packed_rows = (
+        (loan_id, row.sequence, row.due_date, row.principal, row.interest)
+        for loan_id, start_date, periodicity, data in schedules
+        for row in packed.unpack_rows(data, start_date, parse_periodicity(periodicity))
+    )
+    return heapq.merge(payments, packed_rows)
+
+
+def get_payment(loan_id: int, sequence: int) -> Payment:
+    """Return a payment with its loan, whichever storage the loan uses.
+
+    Payments of packed loans are expanded on demand into unsaved ``Payment``
+    instances. Raises ``Payment.DoesNotExist`` when there is no such payment.
+    """
+
+    payment = (
+        Payment.objects.select_related("loan")
+        .filter(loan_id=loan_id, sequence=sequence)
+        .first()
+    )
+    if payment is not None:
+        return payment
+
+    schedule = PackedSchedule.objects.select_related("loan").filter(loan_id=loan_id).first()
+    if schedule is None or not 1 <= sequence <= schedule.loan.number_of_payments:
+        raise Payment.DoesNotExist("Payment matching query does not exist.")
+    loan = schedule.loan
+    row = packed.unpack_row(
+        schedule.data, loan.loan_start_date, parse_periodicity(loan.periodicity), sequence
+    )
+    return Payment(
+        loan=loan,
+        sequence=row.sequence,
+        due_date=row.due_date,
+        principal=row.principal,
+        interest=row.interest,
+        balance=row.balance,
+    )
+
+
+class ScheduleConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The schedule was changed concurrently; please retry."
+    default_code = "conflict"
+
+
+def claim_version(loan: Loan) -> None:
+    """Advance ``loan.version`` unless another writer already has.
+
+    Must run inside the transaction that writes the schedule: this
+    conditional UPDATE is the only lock taken, so it is held just for the
+    writes that follow it. Raises :class:`ScheduleConflict` when the version
+    read earlier is stale.
+    """
+
+    updated = Loan.objects.filter(pk=loan.pk, version=loan.version).update(
+        version=F("version") + 1
+    )
+    if not updated:
+        raise ScheduleConflict()
+    loan.version += 1
+
 
-    if unit == "d":
-        return count / Decimal(365)
-    if unit == "w":
-        return count / Decimal(52)
-    if unit == "m":
-        return count / Decimal(12)
-    if unit == "y":
-        return count
+def retry_on_conflict(func):
+    """Call ``func(attempt)`` until it finishes without a :class:`ScheduleConflict`.
 
-    raise ValueError("Unsupported periodicity unit")
+    At most ``LOANS_ADJUST_ATTEMPTS`` calls are made, sleeping a jittered,
+    exponentially growing multiple of ``LOANS_ADJUST_BACKOFF`` seconds in
+    between; the last conflict propagates.
+    """
 
+    attempts = settings.LOANS_ADJUST_ATTEMPTS
+    for attempt in range(attempts):
+        try:
+            return func(attempt)
+        except ScheduleConflict:
+            if attempt + 1 >= attempts:
+                raise
+            time.sleep(settings.LOANS_ADJUST_BACKOFF * 2**attempt * random.uniform(0.5, 1))
 
-def next_due_date(periodicity: str):
-    total_count, unit = parse_periodicity(periodicity)
-    if unit == "d":
-        delta = relativedelta(days=total_count)
-    if unit == "w":
-        delta = relativedelta(weeks=total_count)
-    if unit == "m":
-        delta = relativedelta(months=total_count)
-    if unit == "y":
-        delta = relativedelta(years=total_count)
-    return delta
 
+def check_reduction(principal: Decimal, reduction: Decimal, sequence: int = None) -> None:
+    if reduction > principal:
+        message = "Reduction cannot exceed current principal"
+        if sequence is not None:
+            message += f" of payment {sequence}"
+        raise serializers.ValidationError({"reduction": message + "."})
 
-def recalculate_interests(changed_payment: Payment, reduction: Decimal):
-    loan = changed_payment.loan
-    payments = list(loan.payments.select_for_update().order_by("sequence"))
 
-    # fraction of a year per period
-    l = get_period_length(loan.periodicity)
-    rate_per_period = loan.interest_rate * l
+def supports_update_from() -> bool:
+    if connection.vendor == "postgresql":
+        return True
+    return connection.vendor == "sqlite" and connection.Database.sqlite_version_info >= (3, 33)
 
-    outstanding = loan.amount
 
-    for payment in payments:
+def update_payments(payments: List[Payment]) -> None:
+    """Write ``principal``, ``interest`` and ``balance`` of many payments.
 
-        # Reduce principal on the changed payment
-        if payment.sequence == changed_payment.sequence:
-            new_principal = max(Decimal("0.00"), payment.principal - reduction)
-            payment.principal = quantize_money(new_principal)
-            payment.save(update_fields=["principal"])
+    On SQLite and PostgreSQL every batch is a single
+    ``WITH v AS (VALUES ...) UPDATE ... FROM v`` statement; ``bulk_update``
+    builds a ``CASE`` per field and row, which takes far longer to compile in
+    Python than the database needs to run it. Other backends (and SQLite
+    before 3.33, which lacks ``UPDATE ... FROM``) fall back to
+    ``bulk_update``.
+    """
 
-        # Compute interest on current outstanding
-        interest = quantize_money(outstanding * rate_per_period)
+    if not payments:
+        return
+    if not supports_update_from():
+        Payment.objects.bulk_update(payments, PAYMENT_AMOUNT_FIELDS)
+        return
+    update_payment_amounts(
+        [
+            (payment.pk, payment.principal, payment.interest, payment.balance)
+            for payment in payments
+        ]
+    )
+
+
+def update_payment_amounts(rows: List[tuple]) -> None:
+    """:func:`update_payments` for ``(pk, principal, interest, balance)`` tuples."""
+
+    if not rows:
+        return
+    if not supports_update_from():
+        Payment.objects.bulk_update(
+            [
+                Payment(pk=pk, principal=principal, interest=interest, balance=balance)
+                for pk, principal, interest, balance in rows
+            ],
+            PAYMENT_AMOUNT_FIELDS,
+        )
+        return
+
+    quote = connection.ops.quote_name
+    table = quote(Payment._meta.db_table)
+    columns = ["id"] + [Payment._meta.get_field(name).column for name in PAYMENT_AMOUNT_FIELDS]
+    assignments = ", ".join(
+        f"{quote(column)} = CAST(v.{quote(column)} AS NUMERIC)" for column in columns[1:]
+    )
+    names = ", ".join(quote(column) for column in columns)
+    placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    batch_size = connection.ops.bulk_batch_size(columns, rows)
+    key = quote("id")
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f"WITH v ({names}) AS (VALUES {', '.join([placeholder] * len(batch))}) "
+                f"UPDATE {table} SET {assignments} FROM v WHERE {table}.{key} = v.{key}",
+                [value for row in batch for value in row],
+            )
+
+
+def read_packed_schedule(loan_id: int) -> Tuple[PackedSchedule, List[engine.ScheduleRow]]:
+    """Read a packed schedule together with its loan (and so its version)."""
+
+    schedule = PackedSchedule.objects.select_related("loan").get(loan_id=loan_id)
+    return schedule, unpack_schedule(schedule.loan, schedule.data)
+
+
+def save_packed_schedule(schedule: PackedSchedule, rows) -> None:
+    schedule.data = packed.pack_rows(rows)
+    PackedSchedule.objects.filter(pk=schedule.pk).update(data=schedule.data)
+
+
+def read_schedule_tail(loan: Loan, sequence: int) -> List[Payment]:
+    return list(loan.payments.filter(sequence__gte=sequence).order_by("sequence"))
+
+
+class ScheduleUpdate:
+    """Outcome of a payment adjustment.
+
+    ``rows`` is the full schedule and ``changes`` the rows whose principal or
+    interest moved, both as ``(sequence, due_date, principal, interest)``
+    tuples; ``version`` is the loan version the write produced.
+    """
+
+    __slots__ = ("loan_id", "rows", "changes", "version")
+
+    def __init__(self, loan_id: int, rows: List[tuple], changes: List[tuple], version: int):
+        self.loan_id = loan_id
+        self.rows = rows
+        self.changes = changes
+        self.version = version
+
+    @property
+    def base_version(self) -> int:
+        """The version the adjustment was applied to."""
+
+        return self.version - 1
+
+
+def changed_tuples(changed, before: dict) -> List[tuple]:
+    """Schedule tuples of the rows whose principal or interest differ from ``before``."""
+
+    to_cents = engine.to_cents
+    return [
+        (row.sequence, row.due_date, row.principal, row.interest)
+        for row in changed
+        if (to_cents(row.principal), to_cents(row.interest)) != before[row.sequence]
+    ]
+
+
+def adjust_payment(payment: Payment, reduction: Decimal) -> List[tuple]:
+    """Reduce a payment's principal and return the updated full schedule.
+
+    The schedule is returned as ``(sequence, due_date, principal, interest)``
+    tuples assembled from the rows already read; see :func:`apply_reduction`.
+    """
+
+    return apply_reduction(payment, reduction).rows
+
+
+def apply_reduction(payment: Payment, reduction: Decimal) -> ScheduleUpdate:
+    """Reduce a payment's principal and describe the resulting schedule.
+
+    The schedule is read without locks, recalculated in memory and written
+    in one short transaction guarded by the loan version (see
+    :func:`claim_version`); on a conflict everything is re-read and retried
+    (see :func:`retry_on_conflict`). ``payment`` must come with its loan, as
+    from :func:`get_payment`, and the reduction is re-checked against fresh
+    data on every attempt.
+    """
+
+    if payment.loan.storage == Loan.STORAGE_PACKED:
+        update = retry_on_conflict(
+            lambda attempt: adjust_packed_payment(payment.loan_id, payment.sequence, reduction)
+        )
+    else:
+
+        def attempt(number: int) -> ScheduleUpdate:
+            current = payment if number == 0 else get_payment(payment.loan_id, payment.sequence)
+            return adjust_row_payment(current, reduction)
+
+        update = retry_on_conflict(attempt)
+    payment.loan.version = update.version
+    return update
+
+
+def adjust_row_payment(payment: Payment, reduction: Decimal) -> ScheduleUpdate:
+    """One optimistic attempt of :func:`adjust_payment` for a row-stored loan."""
+
+    loan = payment.loan
+    tail = read_schedule_tail(loan, payment.sequence)
+    head = list(
+        loan.payments.filter(sequence__lt=payment.sequence)
+        .order_by("sequence")
+        .values_list("sequence", "due_date", "principal", "interest")
+    )
+    current = tail[0]
+    check_reduction(current.principal, reduction)
+    before = cashflow.snapshot(tail)
+
+    original = current.principal
+    current.principal = quantize_money(original - reduction)
+    with span("schedule"):
+        changed = engine.recalculate_interests(
+            tail, current.balance, get_rate_per_period(loan), current.sequence, reduction
+        )
+    if current.principal != original and (not changed or changed[0] is not current):
+        changed.insert(0, current)
+
+    with transaction.atomic():
+        claim_version(loan)
+        update_payments(changed)
+        cashflow.apply_deltas(cashflow.add_changes(cashflow.new_deltas(), changed, before))
+        invalidate_schedules(loan.pk)
+    payment.principal = current.principal
+    return ScheduleUpdate(
+        loan.pk, head + schedule_tuples(tail), changed_tuples(changed, before), loan.version
+    )
+
+
+def adjust_packed_payment(loan_id: int, sequence: int, reduction: Decimal) -> ScheduleUpdate:
+    """One optimistic attempt of :func:`adjust_payment` for a packed loan."""
+
+    schedule, rows = read_packed_schedule(loan_id)
+    loan = schedule.loan
+    payment = rows[sequence - 1]
+    check_reduction(payment.principal, reduction)
+    tail = rows[sequence - 1:]
+    before = cashflow.snapshot(tail)
+
+    original = payment.principal
+    payment.principal = quantize_money(original - reduction)
+    with span("schedule"):
+        changed = engine.recalculate_interests(
+            tail, payment.balance, get_rate_per_period(loan), sequence, reduction
+        )
+    if payment.principal != original and (not changed or changed[0] is not payment):
+        changed.insert(0, payment)
+
+    with transaction.atomic():
+        claim_version(loan)
+        save_packed_schedule(schedule, rows)
+        cashflow.apply_deltas(cashflow.add_changes(cashflow.new_deltas(), changed, before))
+        invalidate_schedules(loan.pk)
+    return ScheduleUpdate(
+        loan.pk, schedule_tuples(rows), changed_tuples(changed, before), loan.version
+    )
+
+
+def adjust_payments(loan_id: int, reductions: Iterable[Tuple[int, Decimal]]) -> list:
+    """Apply several principal reductions to one loan and recalculate once.
+
+    Each ``(sequence, reduction)`` pair has the same effect as a separate
+    :func:`adjust_payment` call, applied in the given order, but the schedule
+    is read, recalculated and written a single time, with the same optimistic
+    versioning and retries. Raises ``ValidationError`` (writing nothing) if
+    any reduction is invalid. Returns the payments (schedule rows for packed
+    loans) that changed.
+    """
+
+    reductions = list(reductions)
+    return retry_on_conflict(lambda attempt: adjust_payments_once(loan_id, reductions))
+
+
+def adjust_payments_once(loan_id: int, reductions: List[Tuple[int, Decimal]]) -> list:
+    try:
+        loan = Loan.objects.get(pk=loan_id)
+    except Loan.DoesNotExist as exc:
+        raise serializers.ValidationError("Loan not found.") from exc
+
+    start_sequence = min(sequence for sequence, _ in reductions)
+    if loan.storage == Loan.STORAGE_PACKED:
+        schedule, rows = read_packed_schedule(loan_id)
+        loan = schedule.loan
+        payments = rows[start_sequence - 1:]
+    else:
+        payments = read_schedule_tail(loan, start_sequence)
+    by_sequence = {payment.sequence: payment for payment in payments}
+    before = cashflow.snapshot(payments)
+
+    principal_changed = {}
+    for sequence, reduction in reductions:
+        payment = by_sequence.get(sequence)
+        if payment is None:
+            raise serializers.ValidationError(f"Payment {sequence} not found.")
+        check_reduction(payment.principal, reduction, sequence)
+        principal = quantize_money(payment.principal - reduction)
+        principal = quantize_money(max(Decimal("0.00"), principal - reduction))
+        if principal != payment.principal:
+            payment.principal = principal
+            principal_changed[sequence] = payment
+
+    with span("schedule"):
+        changed = engine.reamortize(
+            payments, payments[0].balance, get_rate_per_period(loan), start_sequence
+        )
+    for payment in changed:
+        principal_changed.pop(payment.sequence, None)
+    changed = sorted(
+        changed + list(principal_changed.values()), key=lambda payment: payment.sequence
+    )
+
+    with transaction.atomic():
+        claim_version(loan)
+        if loan.storage == Loan.STORAGE_PACKED:
+            save_packed_schedule(schedule, rows)
+        else:
+            update_payments(changed)
+        cashflow.apply_deltas(cashflow.add_changes(cashflow.new_deltas(), changed, before))
+        invalidate_schedules(loan.pk)
+    return changed
+
+
+# Loan columns repricing reads for each chunk.
+REPRICE_LOAN_FIELDS = ("pk", "periodicity", "loan_start_date", "storage", "version")
+
+
+def reprice_loans(
+    rates,
+    chunk_size: int = None,
+    workers: int = None,
+    after: int = 0,
+    progress=None,
+    effective_date: date = None,
+) -> dict:
+    """Move loans to new rates and recompute interests due from ``effective_date`` on.
+
+    ``rates`` is one rate or a ``{loan_id: rate}`` table; loans with
+    ``pk > after`` are read ``chunk_size`` at a time and repriced by
+    ``workers`` processes. ``progress(last_loan_id, totals)`` runs after each
+    chunk commits. Returns the ``loans``, ``repriced`` and ``payments`` totals.
+    """
+
+    chunk_size = chunk_size or settings.LOANS_BULK_BATCH_SIZE
+    workers = os.cpu_count() if workers is None else workers
+    effective_date = effective_date or timezone.localdate()
+    if isinstance(rates, dict):
+        rate_of = rates.__getitem__
+    else:
+        rate_of = lambda loan_id: rates  # noqa: E731
+    totals = {"loans": 0, "repriced": 0, "payments": 0}
+
+    def write(loans, amounts, future: Future) -> None:
+        def attempt(number: int) -> Tuple[int, int]:
+            if number == 0:
+                return write_repricing_chunk(loans, rate_of, *future.result(), amounts)
+            fresh = list(
+                Loan.objects.filter(pk__in=[loan[0] for loan in loans])
+                .order_by("pk")
+                .values_list(*REPRICE_LOAN_FIELDS)
+            )
+            items, fresh_amounts = read_repricing_chunk(fresh, rate_of)
+            return write_repricing_chunk(
+                fresh, rate_of, *repricing.reprice_chunk(items, effective_date), fresh_amounts
+            )
+
+        repriced, payments = retry_on_conflict(attempt)
+        totals["loans"] += len(loans)
+        totals["repriced"] += repriced
+        totals["payments"] += payments
+        if progress is not None:
+            progress(loans[-1][0], dict(totals))
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    window = 2 * workers if pool else 1
+    pending = deque()
+    try:
+        for loans in repricing_chunks(rates, chunk_size, after):
+            items, amounts = read_repricing_chunk(loans, rate_of)
+            if pool is None:
+                future = Future()
+                future.set_result(repricing.reprice_chunk(items, effective_date))
+            else:
+                future = pool.submit(repricing.reprice_chunk, items, effective_date)
+            pending.append((loans, amounts, future))
+            if len(pending) >= window:
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return totals
+
+
+def repricing_chunks(rates, chunk_size: int, after: int):
+    """Yield lists of :data:`REPRICE_LOAN_FIELDS` tuples in ``pk`` order."""
+
+    loans = Loan.objects.order_by("pk").values_list(*REPRICE_LOAN_FIELDS)
+    if isinstance(rates, dict):
+        loan_ids = sorted(loan_id for loan_id in rates if loan_id > after)
+        for start in range(0, len(loan_ids), chunk_size):
+            chunk = list(loans.filter(pk__in=loan_ids[start:start + chunk_size]))
+            if chunk:
+                yield chunk
+        return
+    while True:
+        chunk = list(loans.filter(pk__gt=after)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1][0]
+
+
+def read_repricing_chunk(loans, rate_of) -> Tuple[list, dict]:
+    """Read the schedules of ``loans`` as :func:`loans.repricing.reprice_chunk` input.
+
+    Also returns ``{payment_id: (principal, balance)}`` for row-stored
+    payments, which the write needs alongside the new interests.
+    """
+
+    packed_ids = [loan[0] for loan in loans if loan[3] == Loan.STORAGE_PACKED]
+    data = dict(
+        PackedSchedule.objects.filter(loan_id__in=packed_ids).values_list("loan_id", "data")
+    )
+    payments = {loan[0]: [] for loan in loans if loan[3] != Loan.STORAGE_PACKED}
+    amounts = {}
+    rows = (
+        Payment.objects.filter(loan_id__in=list(payments))
+        .order_by("loan_id", "sequence")
+        .values_list("loan_id", "pk", "due_date", "principal", "interest", "balance")
+    )
+    for loan_id, payment_id, due_date, principal, interest, balance in rows:
+        payments[loan_id].append((payment_id, due_date, interest, balance))
+        amounts[payment_id] = (principal, balance)
+
+    items = [
+        (
+            loan_id,
+            rate_of(loan_id),
+            periodicity,
+            start_date,
+            bytes(data[loan_id]) if storage == Loan.STORAGE_PACKED else None,
+            payments.get(loan_id),
+        )
+        for loan_id, periodicity, start_date, storage, _ in loans
+    ]
+    return items, amounts
 
-        # Update interest for changed and subsequent payments
-        if payment.sequence >= changed_payment.sequence:
-            payment.interest = interest
-            payment.save(update_fields=["interest"])
 
-        # Decrease outstanding by THIS payment's (possibly updated) principal
-        outstanding = max(Decimal("0.00"), outstanding - payment.principal)
+def write_repricing_chunk(loans, rate_of, results, interest_deltas, amounts) -> Tuple[int, int]:
+    """Write one repriced chunk; returns the numbers of changed loans and payments."""
 
+    by_version = defaultdict(list)
+    for loan_id, _, _, _, version in loans:
+        by_version[(version, rate_of(loan_id))].append(loan_id)
+    schedules = []
+    payments = []
+    changed_payments = 0
+    from_cents = engine.from_cents
+    for loan_id, data, changed in results:
+        changed_payments += len(changed)
+        if data is not None:
+            schedules.append(PackedSchedule(loan_id=loan_id, data=data))
+            continue
+        for payment_id, interest in changed:
+            principal, balance = amounts[payment_id]
+            payments.append((payment_id, principal, from_cents(interest), balance))
+    deltas = cashflow.new_deltas()
+    for day, interest in interest_deltas.items():
+        deltas[day][1] += interest
 
-def adjust_payment(payment: Payment, reduction: Decimal) -> Payment:
     with transaction.atomic():
-        payment.principal = quantize_money(payment.principal - reduction)
-        payment.save(update_fields=["principal"])
-        recalculate_interests(payment, reduction)
-    return payment
+        for (version, rate), loan_ids in by_version.items():
+            updated = Loan.objects.filter(pk__in=loan_ids, version=version).update(
+                version=F("version") + 1, interest_rate=rate
+            )
+            if updated != len(loan_ids):
+                raise ScheduleConflict()
+        PackedSchedule.objects.bulk_update(schedules, ["data"])
+        update_payment_amounts(payments)
+        cashflow.apply_deltas(deltas)
+        invalidate_schedules(*(loan[0] for loan in loans))
+    return len(results), changed_payments
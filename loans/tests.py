@@ -1,12 +1,80 @@
-from decimal import Decimal
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import re
+import tempfile
+from datetime import date
+from decimal import Decimal, localcontext
+from unittest import mock, skipIf
 
-from django.test import TestCase
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from dateutil.relativedelta import relativedelta
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework import status
+from rest_framework import serializers, status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
-from .models import Loan
-from .services import get_period_length, quantize_money
+from . import (
+    cashflow,
+    compression,
+    engine,
+    instrumentation,
+    jobs,
+    packed,
+    renderers,
+    services,
+    vectorized,
+)
+from .cache import get_cached_schedule, set_cached_schedule
+from .models import CashflowDay, Loan, PackedSchedule, Payment
+from .serializers import (
+    PaymentSerializer,
+    schedule_row_data,
+    serialize_schedule,
+    serialize_schedule_rows,
+)
+from .services import (
+    adjust_payment,
+    apply_reduction,
+    build_payments,
+    create_loan,
+    get_payment,
+    get_period_length,
+    get_rate_per_period,
+    iter_schedule,
+    parse_periodicity,
+    quantize_money,
+    quote_schedule,
+)
+
+# Loan request body the API tests start from; variants use dict(LOAN_PAYLOAD, ...).
+LOAN_PAYLOAD = {
+    "amount": "1000",
+    "loan_start_date": "2024-01-10",
+    "number_of_payments": 4,
+    "periodicity": "1m",
+    "interest_rate": "0.1",
+}
+
+
+def loan_data(**overrides) -> dict:
+    """``LOAN_PAYLOAD`` with ``overrides``, typed as ``create_loan`` takes it."""
+
+    data = dict(LOAN_PAYLOAD, **overrides)
+    data["amount"] = Decimal(data["amount"])
+    data["loan_start_date"] = date.fromisoformat(data["loan_start_date"])
+    data["interest_rate"] = Decimal(data["interest_rate"])
+    return data
 
 
 class LoanScheduleAPITest(TestCase):
@@ -108,3 +176,1424 @@ class LoanScheduleAPITest(TestCase):
         for sequence, expected_interest in expected_interests.items():
             scheduled_payment = loan.payments.get(sequence=sequence)
             self.assertEqual(scheduled_payment.interest, expected_interest)
+
+
+class LoanBulkCreateAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.payload = dict(LOAN_PAYLOAD)
+
+    def test_bulk_create_matches_single_create(self):
+        single = self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        response = self.client.post(
+            reverse("loan-bulk-create"), data=[self.payload, self.payload], format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 2)
+        for result in response.data["results"]:
+            loan = Loan.objects.get(pk=result["loan_id"])
+            schedule = PaymentSerializer(loan.payments.all(), many=True).data
+            self.assertEqual(schedule, single.data["schedule"])
+
+    def test_bulk_create_reports_item_errors(self):
+        invalid = dict(self.payload, periodicity="1x")
+        response = self.client.post(
+            reverse("loan-bulk-create"), data=[self.payload, invalid], format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(response.data["failed"], 1)
+        self.assertIn("loan_id", response.data["results"][0])
+        self.assertIn("periodicity", response.data["results"][1]["errors"])
+        self.assertEqual(Loan.objects.count(), 1)
+
+    def test_bulk_create_accepts_ndjson(self):
+        body = "\n".join(json.dumps(self.payload) for _ in range(3))
+        response = self.client.post(
+            reverse("loan-bulk-create"), data=body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Loan.objects.count(), 3)
+        self.assertEqual(Payment.objects.count(), 12)
+
+    @override_settings(LOANS_BULK_BATCH_SIZE=2)
+    def test_bulk_create_query_count_depends_on_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("loan-bulk-create"), data=[self.payload] * 4, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        inserts = [q for q in queries if q["sql"].startswith("INSERT")]
+        # Loans, payments and the cash-flow rollup, once per chunk of two.
+        self.assertEqual(len(inserts), 6)
+
+
+class AmortizationEngineTest(SimpleTestCase):
+    def test_generate_schedule_without_models(self):
+        rate = Decimal("0.1") / Decimal(12)
+        rows = engine.generate_schedule(
+            Decimal("1000"), rate, 4, date(2024, 1, 10), engine.get_periodicity("1m")
+        )
+        self.assertEqual([row.sequence for row in rows], [1, 2, 3, 4])
+        self.assertEqual(rows[0].due_date, date(2024, 2, 10))
+        self.assertEqual(rows[0].interest, Decimal("8.33"))
+        self.assertEqual(sum(row.principal for row in rows), Decimal("1000"))
+        emi = engine.calculate_emi(Decimal("1000"), rate, 4)
+        for row in rows[:-1]:
+            self.assertEqual(row.principal + row.interest, emi)
+
+    def test_zero_rate_splits_amount_evenly(self):
+        rows = engine.generate_schedule(
+            Decimal("100"), Decimal("0"), 3, date(2024, 1, 1), engine.get_periodicity("1d")
+        )
+        self.assertEqual(
+            [row.principal for row in rows],
+            [Decimal("33.33"), Decimal("33.33"), Decimal("33.34")],
+        )
+        self.assertTrue(all(row.interest == 0 for row in rows))
+
+    def test_recalculate_interests_returns_tail(self):
+        rate = Decimal("0.1") / Decimal(12)
+        rows = engine.generate_schedule(
+            Decimal("1000"), rate, 4, date(2024, 1, 10), engine.get_periodicity("1m")
+        )
+        original_first = rows[0].interest
+        changed = engine.recalculate_interests(rows[1:], rows[1].balance, rate, 2, Decimal("50"))
+        self.assertEqual([row.sequence for row in changed], [2, 3, 4])
+        self.assertEqual(rows[0].interest, original_first)
+        outstanding = Decimal("1000") - rows[0].principal - rows[1].principal
+        self.assertEqual(rows[2].interest, engine.quantize_money(outstanding * rate))
+
+
+class IntegerCentEngineTest(SimpleTestCase):
+    """Randomized comparison of the integer-cent engine with the Decimal reference."""
+
+    periodicities = ["1d", "5d", "1w", "2w", "1m", "3m", "6m", "1y", "2y"]
+
+    @staticmethod
+    def as_tuples(rows):
+        return [
+            (row.sequence, row.due_date, str(row.principal), str(row.interest), row.balance)
+            for row in rows
+        ]
+
+    def test_schedules_match_decimal_engine(self):
+        rng = random.Random(19)
+        for _ in range(300):
+            amount = Decimal(rng.randint(1, 10**11)).scaleb(-2)
+            periodicity = engine.get_periodicity(rng.choice(self.periodicities))
+            rate = Decimal(rng.randint(0, 10000)).scaleb(-4) * periodicity.year_fraction
+            n = rng.randint(1, 400)
+            start = date(2024, rng.randint(1, 12), rng.randint(1, 28))
+            with self.subTest(amount=amount, rate=rate, n=n, periodicity=periodicity):
+                self.assertEqual(
+                    self.as_tuples(engine.generate_schedule(amount, rate, n, start, periodicity)),
+                    self.as_tuples(
+                        engine.generate_schedule_decimal(amount, rate, n, start, periodicity)
+                    ),
+                )
+
+    def test_interest_matches_decimal_rounding(self):
+        rng = random.Random(1900)
+        for _ in range(200):
+            periods = Decimal(rng.choice([1, 12, 52, 365]))
+            rate = Decimal(rng.randint(0, 10**6)).scaleb(-6) / periods
+            interest = engine.interest_function(rate)
+            for balance in (rng.randint(-10**9, 10**9), rng.randint(2**53, 2**60), 150, 0):
+                expected = engine.quantize_money(engine.from_cents(balance) * rate)
+                self.assertEqual(interest(balance), engine.to_cents(expected), (balance, rate))
+
+    def test_interest_rounds_like_decimal_at_half_cents(self):
+        self.assertEqual(engine.interest_function(Decimal("0.01"))(150), 2)
+        self.assertEqual(engine.interest_function(Decimal("0.01"))(-150), -2)
+        # The exact product is just below half a cent, but Decimal first rounds
+        # it to 28 significant digits, which makes it a tie.
+        rate = Decimal("0.0049999999999999999999999999999")
+        self.assertEqual(engine.interest_function(rate)(100), 1)
+
+    def test_emi_ignores_thread_decimal_context(self):
+        rate = Decimal("0.1") / Decimal(12)
+        expected = engine.calculate_emi(Decimal("250000"), rate, 360)
+        with localcontext() as context:
+            context.prec = 6
+            self.assertEqual(engine.calculate_emi(Decimal("250000"), rate, 360), expected)
+
+
+class PeriodicityTest(SimpleTestCase):
+    def test_periodicity_is_parsed_once(self):
+        self.assertIs(engine.get_periodicity("2w"), engine.get_periodicity("2w"))
+        periodicity = engine.get_periodicity("2w")
+        self.assertEqual(periodicity.year_fraction, Decimal(2) / Decimal(52))
+        self.assertEqual(periodicity.step, relativedelta(weeks=2))
+
+    def test_invalid_periodicity_raises_validation_error(self):
+        for value in ("", "m", "0m", "1x", "am"):
+            with self.assertRaises(serializers.ValidationError):
+                parse_periodicity(value)
+
+    def test_due_dates_match_repeated_step(self):
+        starts = [date(2024, 1, 31), date(2023, 2, 28), date(2024, 2, 29), date(2024, 5, 15)]
+        for value in ("1d", "10d", "2w", "1m", "3m", "5m", "1y", "4y"):
+            periodicity = engine.get_periodicity(value)
+            for start in starts:
+                expected = []
+                current = start
+                for _ in range(30):
+                    current = current + periodicity.step
+                    expected.append(current)
+                self.assertEqual(periodicity.due_dates(start, 30), expected, (value, start))
+
+
+class LoanQuoteAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.payload = dict(LOAN_PAYLOAD, interest_rate="10")
+
+    def test_quote_matches_created_schedule_without_writes(self):
+        with self.assertNumQueries(0):
+            quote = self.client.post(reverse("loan-quote"), data=self.payload, format="json")
+        self.assertEqual(quote.status_code, status.HTTP_200_OK)
+        self.assertEqual(Loan.objects.count(), 0)
+
+        created = self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        self.assertEqual(quote.data["schedule"], created.data["schedule"])
+
+    def test_repeated_quotes_are_cached(self):
+        quote_schedule.cache_clear()
+        self.client.post(reverse("loan-quote"), data=self.payload, format="json")
+        self.client.post(reverse("loan-quote"), data=self.payload, format="json")
+        info = quote_schedule.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 1)
+
+    def test_quote_validates_payload(self):
+        payload = dict(self.payload, periodicity="m")
+        response = self.client.post(reverse("loan-quote"), data=payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecalculateInterestsQueryTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def reduce_and_count_queries(self, number_of_payments):
+        payload = dict(LOAN_PAYLOAD, amount="100000", number_of_payments=number_of_payments)
+        loan_id = self.client.post(
+            reverse("loan-create"), data=payload, format="json"
+        ).data["loan_id"]
+        payment = Payment.objects.select_related("loan").get(loan_id=loan_id, sequence=1)
+        with CaptureQueriesContext(connection) as queries:
+            adjust_payment(payment, Decimal("10"))
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_schedule_length(self):
+        self.assertEqual(self.reduce_and_count_queries(4), self.reduce_and_count_queries(120))
+
+    def test_unchanged_rows_are_not_written(self):
+        loan_id = self.client.post(
+            reverse("loan-create"),
+            data=dict(LOAN_PAYLOAD, interest_rate="0"),
+            format="json",
+        ).data["loan_id"]
+        payment = Payment.objects.select_related("loan").get(loan_id=loan_id, sequence=2)
+        with CaptureQueriesContext(connection) as queries:
+            update = apply_reduction(payment, Decimal("0"))
+        self.assertEqual(update.changes, [])
+        self.assertFalse(any('UPDATE "loans_payment"' in q["sql"] for q in queries))
+
+
+class IncrementalRecalculationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        payload = dict(LOAN_PAYLOAD, amount="10000", number_of_payments=24, interest_rate="0.12")
+        loan_id = self.client.post(
+            reverse("loan-create"), data=payload, format="json"
+        ).data["loan_id"]
+        self.loan = Loan.objects.get(pk=loan_id)
+
+    def assert_balances_consistent(self):
+        outstanding = self.loan.amount
+        for payment in self.loan.payments.order_by("sequence"):
+            self.assertEqual(payment.balance, outstanding)
+            outstanding = max(Decimal("0.00"), outstanding - payment.principal)
+
+    def test_created_schedule_stores_balances(self):
+        self.assert_balances_consistent()
+
+    def test_reduction_reads_only_the_tail(self):
+        payment = Payment.objects.select_related("loan").get(loan=self.loan, sequence=20)
+        with CaptureQueriesContext(connection) as queries:
+            update = apply_reduction(payment, Decimal("100"))
+        selects = [q["sql"] for q in queries if q["sql"].startswith("SELECT")]
+        # Only the tail is read as model rows; the head just fills the response.
+        self.assertEqual(len(selects), 2)
+        self.assertIn('"sequence" >= 20', selects[0])
+        self.assertIn('"sequence" < 20', selects[1])
+        self.assertNotIn('"balance"', selects[1])
+        self.assertEqual([row[0] for row in update.changes], [20, 21, 22, 23, 24])
+        self.assert_balances_consistent()
+
+    def test_tail_recalculation_matches_full_walk(self):
+        payments = list(self.loan.payments.order_by("sequence"))
+        rate = get_rate_per_period(self.loan)
+        payments[14].principal -= Decimal("75")
+        engine.recalculate_interests(payments, self.loan.amount, rate, 15, Decimal("75"))
+
+        adjust_payment(get_payment(self.loan.pk, 15), Decimal("75"))
+        stored = list(self.loan.payments.order_by("sequence"))
+        self.assertEqual(
+            [(p.principal, p.interest, p.balance) for p in stored],
+            [(p.principal, p.interest, p.balance) for p in payments],
+        )
+
+
+class PaymentBatchAdjustmentAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.payload = dict(LOAN_PAYLOAD, amount="5000", number_of_payments=12)
+
+    def create_loan(self):
+        response = self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        return Loan.objects.get(pk=response.data["loan_id"])
+
+    def schedule(self, loan):
+        return list(loan.payments.order_by("sequence").values_list("principal", "interest", "balance"))
+
+    def test_batch_matches_sequential_adjustments(self):
+        reductions = [(7, "20"), (3, "15.50"), (7, "5"), (10, "100")]
+        sequential = self.create_loan()
+        for sequence, reduction in reductions:
+            url = reverse("payment-reduce", args=[sequential.pk, sequence])
+            self.client.post(url, data={"reduction": reduction}, format="json")
+
+        batched = self.create_loan()
+        other = self.create_loan()
+        items = [
+            {"loan_id": batched.pk, "sequence": sequence, "reduction": reduction}
+            for sequence, reduction in reductions
+        ]
+        items.append({"loan_id": other.pk, "sequence": 1, "reduction": "1"})
+        response = self.client.post(reverse("payment-batch-reduce"), data=items, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"][0]["applied"], 4)
+        self.assertEqual(self.schedule(batched), self.schedule(sequential))
+        self.assertNotEqual(self.schedule(other), self.schedule(self.create_loan()))
+
+    def test_invalid_loan_is_rolled_back_alone(self):
+        valid = self.create_loan()
+        invalid = self.create_loan()
+        before = self.schedule(invalid)
+        items = [
+            {"loan_id": valid.pk, "sequence": 2, "reduction": "10"},
+            {"loan_id": invalid.pk, "sequence": 2, "reduction": "10"},
+            {"loan_id": invalid.pk, "sequence": 99, "reduction": "10"},
+            {"loan_id": 999, "sequence": 1, "reduction": "10"},
+        ]
+        response = self.client.post(reverse("payment-batch-reduce"), data=items, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = {result["loan_id"]: result for result in response.data["results"]}
+        self.assertIn("changed_payments", results[valid.pk])
+        self.assertIn("errors", results[invalid.pk])
+        self.assertIn("errors", results[999])
+        self.assertEqual(self.schedule(invalid), before)
+
+    def test_empty_batch_is_rejected(self):
+        response = self.client.post(reverse("payment-batch-reduce"), data=[], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StreamingScheduleAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.payload = dict(
+            LOAN_PAYLOAD,
+            amount="20000",
+            number_of_payments=365,
+            periodicity="1d",
+            interest_rate="0.2",
+        )
+
+    def read_lines(self, response):
+        body = b"".join(response.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_create_streams_ndjson_schedule(self):
+        regular = self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        response = self.client.post(
+            reverse("loan-create"),
+            data=self.payload,
+            format="json",
+            HTTP_ACCEPT="application/x-ndjson",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertTrue(Loan.objects.filter(pk=response["X-Loan-Id"]).exists())
+        self.assertEqual(self.read_lines(response), json.loads(regular.content)["schedule"])
+
+    def test_reduce_streams_with_format_parameter(self):
+        loan_id = self.client.post(
+            reverse("loan-create"), data=self.payload, format="json"
+        ).data["loan_id"]
+        url = reverse("payment-reduce", args=[loan_id, 10]) + "?format=ndjson"
+        response = self.client.post(url, data={"reduction": "5"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = self.read_lines(response)
+        self.assertEqual(len(lines), 365)
+        self.assertEqual(
+            Decimal(lines[9]["principal"]),
+            Payment.objects.get(loan_id=loan_id, sequence=10).principal,
+        )
+
+    def test_validation_errors_are_rendered_as_a_single_line(self):
+        payload = dict(self.payload, periodicity="1x")
+        response = self.client.post(
+            reverse("loan-create"),
+            data=payload,
+            format="json",
+            HTTP_ACCEPT="application/x-ndjson",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("periodicity", json.loads(response.content))
+
+
+class ScheduleSerializationParityTest(TestCase):
+    def test_fast_path_matches_payment_serializer(self):
+        rnd = random.Random(7)
+        for _ in range(20):
+            loan, _ = create_loan(
+                {
+                    "amount": Decimal(rnd.randint(100, 10**8)) / 100,
+                    "loan_start_date": date(2024, 1, 31),
+                    "number_of_payments": rnd.randint(1, 60),
+                    "periodicity": f"{rnd.randint(1, 3)}{rnd.choice('dwmy')}",
+                    "interest_rate": Decimal(rnd.randint(0, 9999)) / 10000,
+                }
+            )
+            expected = PaymentSerializer(loan.payments.all(), many=True).data
+            self.assertEqual(serialize_schedule(iter_schedule(loan)), expected)
+            self.assertEqual(serialize_schedule_rows(build_payments(loan)), expected)
+            self.assertEqual(
+                JSONRenderer().render(serialize_schedule(iter_schedule(loan))),
+                JSONRenderer().render(expected),
+            )
+
+
+class ScheduleInHandResponseTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.payload = dict(
+            LOAN_PAYLOAD,
+            amount="3000",
+            loan_start_date="2024-01-31",
+            number_of_payments=12,
+            interest_rate="0.15",
+        )
+
+    def persisted_schedule(self, loan_id):
+        payments = Payment.objects.filter(loan_id=loan_id)
+        return JSONRenderer().render(PaymentSerializer(payments, many=True).data)
+
+    def test_create_does_not_query_the_schedule_back(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        self.assertFalse(any(q["sql"].startswith("SELECT") for q in queries))
+        self.assertEqual(
+            JSONRenderer().render(response.data["schedule"]),
+            self.persisted_schedule(response.data["loan_id"]),
+        )
+
+    def test_reduce_returns_persisted_schedule_without_full_reselect(self):
+        loan_id = self.client.post(
+            reverse("loan-create"), data=self.payload, format="json"
+        ).data["loan_id"]
+        url = reverse("payment-reduce", args=[loan_id, 5])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data={"reduction": "40"}, format="json")
+        payment_selects = [
+            q["sql"] for q in queries
+            if q["sql"].startswith("SELECT") and 'FROM "loans_payment"' in q["sql"]
+        ]
+        self.assertEqual(len(payment_selects), 3)
+        self.assertEqual(
+            JSONRenderer().render(response.data["schedule"]),
+            self.persisted_schedule(loan_id),
+        )
+
+
+class LoanScheduleReadAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.payload = dict(LOAN_PAYLOAD, amount="1200", number_of_payments=6)
+        self.created = self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        self.loan_id = self.created.data["loan_id"]
+        self.url = reverse("loan-schedule", args=[self.loan_id])
+
+    def test_read_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(first.content), json.loads(self.created.content))
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+    def test_if_none_match_accepts_lists_and_wildcard(self):
+        etag = self.client.get(self.url)["ETag"]
+        for header in (f'"other", {etag}', f"W/{etag}", "*"):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=header)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, header)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"x{etag[1:]}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_schedule_read_before_a_write_is_not_cached_after_it(self):
+        stale_version = Loan.objects.get(pk=self.loan_id).version
+        reduce_url = reverse("payment-reduce", args=[self.loan_id, 2])
+        self.client.post(reduce_url, data={"reduction": "10"}, format="json")
+        set_cached_schedule(self.loan_id, b"stale", stale_version)
+        self.assertIsNone(get_cached_schedule(self.loan_id))
+        self.assertNotEqual(self.client.get(self.url).content, b"stale")
+
+    def test_adjustment_invalidates_cached_schedule(self):
+        etag = self.client.get(self.url)["ETag"]
+        reduce_url = reverse("payment-reduce", args=[self.loan_id, 2])
+        reduced = self.client.post(reduce_url, data={"reduction": "10"}, format="json")
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(json.loads(response.content), json.loads(reduced.content))
+
+    def test_batch_adjustment_invalidates_cached_schedule(self):
+        before = self.client.get(self.url).content
+        items = [{"loan_id": self.loan_id, "sequence": 3, "reduction": "10"}]
+        self.client.post(reverse("payment-batch-reduce"), data=items, format="json")
+        self.assertNotEqual(self.client.get(self.url).content, before)
+
+    def test_unknown_loan_returns_not_found(self):
+        response = self.client.get(reverse("loan-schedule", args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class VectorizedEngineTest(TestCase):
+    def test_matches_decimal_engine(self):
+        rnd = random.Random(11)
+        amounts, rates, periodicities, counts = [], [], [], []
+        for _ in range(200):
+            amounts.append(Decimal(rnd.randint(1, 10**11)) / 100)
+            rates.append(Decimal(rnd.choice([0, rnd.randint(1, 20000)])) / 10000)
+            periodicities.append(f"{rnd.randint(1, 4)}{rnd.choice('dwmy')}")
+            counts.append(rnd.choice([1, 2, 12, rnd.randint(1, 400)]))
+
+        schedules = vectorized.generate_schedules(amounts, rates, periodicities, counts)
+
+        for index in range(len(amounts)):
+            periodicity = engine.get_periodicity(periodicities[index])
+            rows = engine.generate_schedule(
+                amounts[index],
+                rates[index] * periodicity.year_fraction,
+                counts[index],
+                date(2024, 1, 1),
+                periodicity,
+            )
+            self.assertEqual(
+                schedules.loan(index),
+                [(row.sequence, row.principal, row.interest) for row in rows],
+            )
+
+    def test_half_cent_interest_uses_decimal_rounding(self):
+        # 1.80 * 0.1 / 12 is 1.5 cents in floating point, right on the
+        # rounding boundary, so the value must come from the Decimal engine.
+        schedules = vectorized.generate_schedules(["1.80"], ["0.1"], ["1m"], [2])
+        periodicity = engine.get_periodicity("1m")
+        rows = engine.generate_schedule(
+            Decimal("1.80"),
+            Decimal("0.1") * periodicity.year_fraction,
+            2,
+            date(2024, 1, 1),
+            periodicity,
+        )
+        self.assertEqual(
+            schedules.loan(0), [(row.sequence, row.principal, row.interest) for row in rows]
+        )
+
+    def test_management_command_uses_stored_loans(self):
+        create_loan(loan_data())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "schedules.csv")
+            out = io.StringIO()
+            call_command("portfolio_schedules", output=path, stdout=out)
+            with open(path) as handle:
+                rows = list(csv.DictReader(handle))
+        self.assertIn("Generated 1 schedules (4 payments)", out.getvalue())
+        stored = Payment.objects.order_by("sequence").values_list("principal", "interest")
+        self.assertEqual(
+            [(Decimal(row["principal"]), Decimal(row["interest"])) for row in rows],
+            list(stored),
+        )
+
+
+class AsyncLoanAPITest(TestCase):
+    payload = LOAN_PAYLOAD
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_async_endpoints_match_sync_responses(self):
+        client = AsyncClient()
+        created = await client.post(
+            reverse("async-loan-create"), data=self.payload, content_type="application/json"
+        )
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        loan_id = json.loads(created.content)["loan_id"]
+        expected = await sync_to_async(
+            lambda: list(PaymentSerializer(Payment.objects.filter(loan_id=loan_id), many=True).data)
+        )()
+        self.assertEqual(json.loads(created.content)["schedule"], expected)
+
+        reduced = await client.post(
+            reverse("async-payment-reduce", args=[loan_id, 2]),
+            data={"reduction": "50"},
+            content_type="application/json",
+        )
+        self.assertEqual(reduced.status_code, status.HTTP_200_OK)
+
+        schedule = await client.get(reverse("async-loan-schedule", args=[loan_id]))
+        self.assertEqual(schedule.content, reduced.content)
+        not_modified = await client.get(
+            reverse("async-loan-schedule", args=[loan_id]),
+            headers={"If-None-Match": schedule["ETag"]},
+        )
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_async_endpoints_support_packed_storage(self):
+        client = AsyncClient()
+        created = await client.post(
+            reverse("async-loan-create"),
+            data=dict(self.payload, storage="packed"),
+            content_type="application/json",
+        )
+        loan_id = json.loads(created.content)["loan_id"]
+        reduced = await client.post(
+            reverse("async-payment-reduce", args=[loan_id, 2]),
+            data={"reduction": "50"},
+            content_type="application/json",
+        )
+        self.assertEqual(reduced.status_code, status.HTTP_200_OK)
+        schedule = await client.get(reverse("async-loan-schedule", args=[loan_id]))
+        self.assertEqual(schedule.content, reduced.content)
+
+    async def test_async_errors(self):
+        client = AsyncClient()
+        invalid = await client.post(
+            reverse("async-loan-create"),
+            data=dict(self.payload, periodicity="1x"),
+            content_type="application/json",
+        )
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("periodicity", json.loads(invalid.content))
+
+        missing = await client.post(
+            reverse("async-payment-reduce", args=[999, 1]),
+            data={"reduction": "1"},
+            content_type="application/json",
+        )
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+        missing = await client.get(reverse("async-loan-schedule", args=[999]))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_benchmark_reports_and_compares_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            out = io.StringIO()
+            call_command(
+                "benchmark", sizes=[3], repeat=1, requests=1,
+                use_current_db=True, save_baseline=path, stdout=out,
+            )
+            with open(path) as handle:
+                results = json.load(handle)
+            self.assertIn("load/payment-reduce", out.getvalue())
+            self.assertGreater(results["3"]["load"]["loan-create"]["queries_per_request"], 0)
+
+            results["3"]["load"]["loan-create"]["queries_per_request"] = 0
+            with open(path, "w") as handle:
+                json.dump(results, handle)
+            with self.assertRaisesMessage(CommandError, "loan-create: queries"):
+                call_command(
+                    "benchmark", sizes=[3], repeat=1, requests=1,
+                    use_current_db=True, baseline=path, stdout=io.StringIO(),
+                )
+
+
+class InstrumentationTest(TestCase):
+    payload = LOAN_PAYLOAD
+
+    def setUp(self):
+        instrumentation.registry.reset()
+
+    @override_settings(LOANS_INSTRUMENTATION=True)
+    def test_server_timing_and_metrics(self):
+        client = APIClient()
+        response = client.post(reverse("loan-create"), data=self.payload, format="json")
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn("schedule;dur=", timing)
+        self.assertIn("serialize;dur=", timing)
+        self.assertIn("total;dur=", timing)
+
+        metrics = client.get(reverse("metrics")).content.decode()
+        self.assertIn('loans_requests_total{endpoint="loan-create",status="201"} 1', metrics)
+        self.assertIn('loans_request_duration_seconds_count{endpoint="loan-create"} 1', metrics)
+        self.assertIn(
+            'loans_section_duration_seconds_count{endpoint="loan-create",section="schedule"} 1',
+            metrics,
+        )
+        self.assertIn('loans_response_bytes_bucket{endpoint="loan-create",le="+Inf"} 1', metrics)
+
+    @override_settings(LOANS_INSTRUMENTATION=True)
+    async def test_async_requests_stay_async(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        self.assertTrue(
+            iscoroutinefunction(instrumentation.PerformanceMiddleware(get_response))
+        )
+        response = await AsyncClient().post(
+            reverse("async-loan-create"), data=self.payload, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        queries = re.search(r'desc="(\d+) queries"', response["Server-Timing"])
+        self.assertGreater(int(queries.group(1)), 0)
+        self.assertIn("schedule;dur=", response["Server-Timing"])
+
+    def test_disabled_by_default(self):
+        client = APIClient()
+        response = client.post(reverse("loan-create"), data=self.payload, format="json")
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(client.get(reverse("metrics")).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIs(instrumentation.span("schedule"), instrumentation.span("serialize"))
+
+
+@override_settings(LOANS_ASYNC_JOB_THRESHOLD=10, LOANS_JOB_BACKEND="inprocess")
+class BackgroundJobAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.payload = dict(LOAN_PAYLOAD, amount="5000", number_of_payments=20, periodicity="1w")
+
+    def test_large_loan_creation_runs_as_job(self):
+        response = self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response["Location"], response.data["status_url"])
+
+        job = self.client.get(reverse("job-status", args=[response.data["job_id"]]))
+        self.assertEqual(job.data["status"], jobs.DONE)
+        self.assertNotIn("payload", job.data)
+        loan_id = job.data["result"]["loan_id"]
+        self.assertEqual(
+            job.data["result"]["schedule"],
+            list(PaymentSerializer(Payment.objects.filter(loan_id=loan_id), many=True).data),
+        )
+
+    def test_form_encoded_loan_creation_runs_as_job(self):
+        response = self.client.post(
+            reverse("loan-create"), data=dict(self.payload, interest_rate="15")
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = self.client.get(reverse("job-status", args=[response.data["job_id"]]))
+        self.assertEqual(job.data["status"], jobs.DONE)
+        loan = Loan.objects.get(pk=job.data["result"]["loan_id"])
+        self.assertEqual(loan.number_of_payments, 20)
+        self.assertEqual(loan.interest_rate, Decimal("0.15"))
+
+    def test_small_loan_is_created_inline(self):
+        payload = dict(self.payload, number_of_payments=10)
+        response = self.client.post(reverse("loan-create"), data=payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_large_loan_adjustment_runs_as_job(self):
+        with self.settings(LOANS_ASYNC_JOB_THRESHOLD=None):
+            loan_id = self.client.post(
+                reverse("loan-create"), data=self.payload, format="json"
+            ).data["loan_id"]
+        url = reverse("payment-reduce", args=[loan_id, 3])
+        response = self.client.post(url, data={"reduction": "20"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        job = self.client.get(response["Location"])
+        self.assertEqual(job.data["status"], jobs.DONE)
+        self.assertEqual(
+            json.loads(json.dumps(job.data["result"])),
+            json.loads(self.client.get(reverse("loan-schedule", args=[loan_id])).content),
+        )
+
+    async def test_async_views_run_large_loans_as_jobs(self):
+        client = AsyncClient()
+        response = await client.post(
+            reverse("async-loan-create"), data=self.payload, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        data = json.loads(response.content)
+        self.assertEqual(response["Location"], data["status_url"])
+        self.assertEqual(data["status"], jobs.DONE)
+        loan_id = (await sync_to_async(jobs.get_job)(data["job_id"]))["result"]["loan_id"]
+
+        response = await client.post(
+            reverse("async-payment-reduce", args=[loan_id, 3]),
+            data={"reduction": "20"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = await client.get(response["Location"])
+        self.assertEqual(json.loads(job.content)["status"], jobs.DONE)
+
+    def test_failed_job_reports_errors(self):
+        job = jobs.enqueue("adjust_payment", {"loan_id": 999, "sequence": 1, "reduction": "1"})
+        self.assertEqual(job["status"], jobs.FAILED)
+        response = self.client.get(reverse("job-status", args=[job["id"]]))
+        self.assertIn("errors", response.data)
+
+    def test_unknown_job_returns_not_found(self):
+        response = self.client.get(reverse("job-status", args=["missing"]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PackedScheduleStorageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.payload = dict(
+            LOAN_PAYLOAD, amount="10000", loan_start_date="2024-01-31", number_of_payments=24
+        )
+
+    def create(self, storage):
+        payload = dict(self.payload, storage=storage)
+        response = self.client.post(reverse("loan-create"), data=payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response
+
+    def schedule(self, loan_id):
+        return json.loads(self.client.get(reverse("loan-schedule", args=[loan_id])).content)
+
+    def test_pack_round_trip(self):
+        periodicity = engine.get_periodicity("1m")
+        rows = engine.generate_schedule(
+            Decimal("10000"), Decimal("0.1") / 12, 24, date(2024, 1, 31), periodicity
+        )
+        data = packed.pack_rows(rows)
+        self.assertEqual(len(data), 24 * 3 * 8)
+        self.assertEqual(packed.unpack_rows(data, date(2024, 1, 31), periodicity), rows)
+        self.assertEqual(packed.unpack_row(data, date(2024, 1, 31), periodicity, 5), rows[4])
+
+    def test_packed_loan_stores_one_row(self):
+        rows_response = self.create("rows")
+        packed_response = self.create("packed")
+        loan_id = packed_response.data["loan_id"]
+
+        self.assertEqual(Payment.objects.filter(loan_id=loan_id).count(), 0)
+        self.assertTrue(PackedSchedule.objects.filter(loan_id=loan_id).exists())
+        self.assertEqual(packed_response.data["schedule"], rows_response.data["schedule"])
+        self.assertEqual(self.schedule(loan_id)["schedule"], rows_response.data["schedule"])
+
+    def test_default_storage_comes_from_settings(self):
+        with self.settings(LOANS_SCHEDULE_STORAGE="packed"):
+            loan, _ = create_loan(loan_data(number_of_payments=6))
+        self.assertEqual(loan.storage, Loan.STORAGE_PACKED)
+        self.assertFalse(loan.payments.exists())
+
+    def test_packed_adjustments_match_row_storage(self):
+        loan_ids = [self.create(storage).data["loan_id"] for storage in ("rows", "packed")]
+        responses = [
+            self.client.post(
+                reverse("payment-reduce", args=[loan_id, 5]),
+                data={"reduction": "100"},
+                format="json",
+            )
+            for loan_id in loan_ids
+        ]
+        self.assertEqual(responses[0].data["schedule"], responses[1].data["schedule"])
+
+        batch = [
+            {"loan_id": loan_id, "sequence": sequence, "reduction": "25"}
+            for loan_id in loan_ids
+            for sequence in (9, 3)
+        ]
+        response = self.client.post(reverse("payment-batch-reduce"), data=batch, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        changed = [result["changed_payments"] for result in response.data["results"]]
+        self.assertEqual(changed[0], changed[1])
+        schedules = [self.schedule(loan_id)["schedule"] for loan_id in loan_ids]
+        self.assertEqual(schedules[0], schedules[1])
+
+    def test_packed_reduction_is_validated(self):
+        loan_id = self.create("packed").data["loan_id"]
+        url = reverse("payment-reduce", args=[loan_id, 25])
+        response = self.client.post(url, data={"reduction": "1"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        url = reverse("payment-reduce", args=[loan_id, 1])
+        response = self.client.post(url, data={"reduction": "100000"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_packed_schedule_streams_as_ndjson(self):
+        response = self.create("packed")
+        loan = Loan.objects.get(pk=response.data["loan_id"])
+        streamed = self.client.get(
+            reverse("loan-schedule", args=[loan.pk]), HTTP_ACCEPT="application/x-ndjson"
+        )
+        lines = b"".join(streamed.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], response.data["schedule"])
+        self.assertEqual(serialize_schedule(iter_schedule(loan)), response.data["schedule"])
+
+
+@override_settings(LOANS_ADJUST_BACKOFF=0)
+class OptimisticConcurrencyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.data = loan_data(amount="12000", number_of_payments=120, interest_rate="0.12")
+
+    def test_stale_adjustment_is_retried_on_fresh_data(self):
+        for storage in (Loan.STORAGE_ROWS, Loan.STORAGE_PACKED):
+            loan, _ = create_loan(dict(self.data, storage=storage))
+            reference, _ = create_loan(dict(self.data, storage=storage))
+            stale = get_payment(loan.pk, 3)
+            adjust_payment(get_payment(loan.pk, 5), Decimal("20"))
+            rows = adjust_payment(stale, Decimal("10"))
+
+            adjust_payment(get_payment(reference.pk, 5), Decimal("20"))
+            expected = adjust_payment(get_payment(reference.pk, 3), Decimal("10"))
+            self.assertEqual(rows, expected, storage)
+            loan.refresh_from_db()
+            self.assertEqual(loan.version, 2)
+
+    def test_adjustment_writes_in_short_statements(self):
+        loan, _ = create_loan(self.data)
+        payment = get_payment(loan.pk, 1)
+        with CaptureQueriesContext(connection) as queries:
+            rows = adjust_payment(payment, Decimal("10"))
+        updates = [q["sql"] for q in queries if q["sql"].lstrip().startswith(("UPDATE", "WITH"))]
+        self.assertEqual(len(updates), 2)
+        self.assertFalse(any("CASE" in sql or "FOR UPDATE" in sql for sql in updates))
+        self.assertEqual(
+            list(PaymentSerializer(loan.payments.order_by("sequence"), many=True).data),
+            serialize_schedule(rows),
+        )
+
+    def test_exhausted_retries_answer_conflict(self):
+        loan, _ = create_loan(self.data)
+        before = serialize_schedule(iter_schedule(loan))
+        url = reverse("payment-reduce", args=[loan.pk, 2])
+        with mock.patch.object(
+            services, "claim_version", side_effect=services.ScheduleConflict
+        ) as claim:
+            response = self.client.post(url, data={"reduction": "10"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(claim.call_count, 5)
+        self.assertEqual(serialize_schedule(iter_schedule(loan)), before)
+
+
+class CashflowAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.payload = dict(
+            LOAN_PAYLOAD,
+            amount="3000",
+            loan_start_date="2024-01-31",
+            number_of_payments=6,
+            interest_rate="0.12",
+        )
+
+    def get_cashflow(self, **params):
+        params = {"from": "2024-01-01", "to": "2024-12-31", **params}
+        response = self.client.get(reverse("cashflow"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["results"]
+
+    def expected_by_day(self):
+        totals = {}
+        for payment in Payment.objects.all():
+            principal, interest = totals.get(payment.due_date, (Decimal("0"), Decimal("0")))
+            totals[payment.due_date] = (principal + payment.principal, interest + payment.interest)
+        for schedule in PackedSchedule.objects.select_related("loan"):
+            for row in services.unpack_schedule(schedule.loan, schedule.data):
+                principal, interest = totals.get(row.due_date, (Decimal("0"), Decimal("0")))
+                totals[row.due_date] = (principal + row.principal, interest + row.interest)
+        return [
+            {"period": day.isoformat(), "principal": format(p, "f"), "interest": format(i, "f")}
+            for day, (p, i) in sorted(totals.items())
+        ]
+
+    def test_rollup_follows_creation_and_adjustments(self):
+        self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        packed_id = self.client.post(
+            reverse("loan-create"), data=dict(self.payload, storage="packed"), format="json"
+        ).data["loan_id"]
+        self.client.post(
+            reverse("loan-bulk-create"),
+            data=[dict(self.payload, loan_start_date="2024-02-15", number_of_payments=3)] * 2,
+            format="json",
+        )
+        self.assertEqual(self.get_cashflow(), self.expected_by_day())
+
+        loan_id = Loan.objects.filter(storage=Loan.STORAGE_ROWS).first().pk
+        self.client.post(
+            reverse("payment-reduce", args=[loan_id, 2]), data={"reduction": "100"}, format="json"
+        )
+        self.client.post(
+            reverse("payment-reduce", args=[packed_id, 3]), data={"reduction": "40"}, format="json"
+        )
+        self.client.post(
+            reverse("payment-batch-reduce"),
+            data=[
+                {"loan_id": loan_id, "sequence": 4, "reduction": "10"},
+                {"loan_id": packed_id, "sequence": 1, "reduction": "25"},
+            ],
+            format="json",
+        )
+        self.assertEqual(self.get_cashflow(), self.expected_by_day())
+
+        CashflowDay.objects.all().delete()
+        cashflow.rebuild()
+        self.assertEqual(self.get_cashflow(), self.expected_by_day())
+
+    def test_month_buckets(self):
+        self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        self.client.post(
+            reverse("loan-create"),
+            data=dict(self.payload, periodicity="1w", number_of_payments=10),
+            format="json",
+        )
+        by_day = self.get_cashflow()
+        by_month = self.get_cashflow(bucket="month")
+        self.assertEqual(by_month[0]["period"], "2024-02-01")
+        self.assertEqual(
+            sum(Decimal(row["interest"]) for row in by_month),
+            sum(Decimal(row["interest"]) for row in by_day),
+        )
+        february = [row for row in by_day if row["period"].startswith("2024-02")]
+        self.assertEqual(
+            Decimal(by_month[0]["principal"]), sum(Decimal(row["principal"]) for row in february)
+        )
+
+    def test_query_count_does_not_depend_on_loans(self):
+        self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        with self.assertNumQueries(1):
+            self.get_cashflow(bucket="month")
+
+    def test_invalid_query(self):
+        response = self.client.get(
+            reverse("cashflow"), {"from": "2024-05-01", "to": "2024-01-01", "bucket": "week"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("bucket", response.data)
+        response = self.client.get(reverse("cashflow"), {"from": "2024-05-01", "to": "2024-01-01"})
+        self.assertIn("to", response.data)
+
+
+class ScheduleDeltaAPITest(TestCase):
+    payload = dict(LOAN_PAYLOAD, amount="6000", number_of_payments=12, interest_rate="0.12")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def reduce(self, loan_id, sequence, url_name="payment-reduce", **data):
+        return self.client.post(
+            reverse(url_name, args=[loan_id, sequence]),
+            data={"reduction": "50", **data},
+            format="json",
+        )
+
+    def apply_changes(self, schedule, changes):
+        patched = {row["id"]: row for row in schedule}
+        patched.update((row["id"], row) for row in changes)
+        return [patched[key] for key in sorted(patched)]
+
+    def test_current_version_gets_only_changed_rows(self):
+        for storage in (Loan.STORAGE_ROWS, Loan.STORAGE_PACKED):
+            created = self.client.post(
+                reverse("loan-create"), data=dict(self.payload, storage=storage), format="json"
+            )
+            self.assertEqual(created["X-Schedule-Version"], "0")
+            loan_id = created.data["loan_id"]
+            read = self.client.get(reverse("loan-schedule", args=[loan_id]))
+            self.assertEqual(read["X-Schedule-Version"], "0")
+
+            response = self.reduce(loan_id, 4, since_version=0)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response["X-Schedule-Version"], "1")
+            self.assertEqual(response.data["version"], 1)
+            self.assertEqual(response.data["base_version"], 0)
+            self.assertNotIn("schedule", response.data)
+            self.assertEqual([row["id"] for row in response.data["changes"]], list(range(4, 13)))
+
+            current = self.client.get(reverse("loan-schedule", args=[loan_id]))
+            self.assertEqual(current["X-Schedule-Version"], "1")
+            self.assertEqual(
+                self.apply_changes(created.data["schedule"], response.data["changes"]),
+                current.json()["schedule"],
+            )
+
+    def test_stale_version_gets_full_schedule(self):
+        loan_id = self.client.post(reverse("loan-create"), data=self.payload, format="json").data[
+            "loan_id"
+        ]
+        self.reduce(loan_id, 2)
+        response = self.reduce(loan_id, 3, since_version=0)
+        self.assertEqual(response["X-Schedule-Version"], "2")
+        self.assertNotIn("changes", response.data)
+        self.assertEqual(len(response.data["schedule"]), 12)
+
+    async def test_async_adjustment_supports_deltas(self):
+        loan, _ = await sync_to_async(create_loan)(loan_data(**self.payload))
+        client = AsyncClient()
+        response = await client.post(
+            reverse("async-payment-reduce", args=[loan.pk, 11]),
+            data={"reduction": "50", "since_version": 0},
+            content_type="application/json",
+        )
+        self.assertEqual(response["X-Schedule-Version"], "1")
+        body = json.loads(response.content)
+        self.assertEqual([row["id"] for row in body["changes"]], [11, 12])
+        read = await client.get(reverse("async-loan-schedule", args=[loan.pk]))
+        self.assertEqual(read["X-Schedule-Version"], "1")
+
+
+class RepricingTest(TestCase):
+    # Before every due date of the 2024 schedules below.
+    effective_date = date(2024, 1, 31)
+
+    def setUp(self):
+        cache.clear()
+        self.data = loan_data(
+            amount="5000", loan_start_date="2024-01-31", number_of_payments=12
+        )
+        self.loans = [
+            create_loan(dict(self.data, storage=storage, number_of_payments=count))[0]
+            for storage in (Loan.STORAGE_ROWS, Loan.STORAGE_PACKED)
+            for count in (6, 12)
+        ]
+        for loan in self.loans[::2]:
+            adjust_payment(get_payment(loan.pk, 2), Decimal("100"))
+
+    def schedule(self, loan):
+        loan.refresh_from_db()
+        if loan.storage == Loan.STORAGE_PACKED:
+            return services.unpack_schedule(loan, loan.packed_schedule.data)
+        return list(loan.payments.order_by("sequence"))
+
+    def assert_repriced(self, loan, rate, before):
+        rows = self.schedule(loan)
+        self.assertEqual(loan.interest_rate, rate)
+        rate_per_period = rate * engine.get_periodicity(loan.periodicity).year_fraction
+        self.assertEqual(
+            [(row.principal, row.balance) for row in rows],
+            [(row.principal, row.balance) for row in before],
+        )
+        self.assertEqual(
+            [row.interest for row in rows],
+            [engine.quantize_money(row.balance * rate_per_period) for row in rows],
+        )
+
+    def assert_cashflow_consistent(self):
+        expected = list(CashflowDay.objects.order_by("day").values_list())
+        cashflow.rebuild()
+        self.assertEqual(list(CashflowDay.objects.order_by("day").values_list()), expected)
+
+    def test_reprice_keeps_principals_and_bumps_versions(self):
+        before = {loan.pk: self.schedule(loan) for loan in self.loans}
+        versions = {loan.pk: loan.version for loan in self.loans}
+        progress = []
+        totals = services.reprice_loans(
+            Decimal("0.18"),
+            chunk_size=3,
+            workers=1,
+            progress=lambda *args: progress.append(args),
+            effective_date=self.effective_date,
+        )
+        self.assertEqual(totals["loans"], 4)
+        self.assertEqual(totals["repriced"], 4)
+        self.assertEqual([last for last, _ in progress], [self.loans[2].pk, self.loans[3].pk])
+        for loan in self.loans:
+            self.assert_repriced(loan, Decimal("0.18"), before[loan.pk])
+            self.assertEqual(loan.version, versions[loan.pk] + 1)
+        self.assert_cashflow_consistent()
+
+    def test_worker_processes_match_in_process_run(self):
+        options = {"effective_date": self.effective_date}
+        services.reprice_loans(Decimal("0.07"), chunk_size=1, workers=2, **options)
+        pooled = {loan.pk: [row.interest for row in self.schedule(loan)] for loan in self.loans}
+        services.reprice_loans(Decimal("0.1"), workers=1, **options)
+        services.reprice_loans(Decimal("0.07"), workers=1, **options)
+        self.assertEqual(
+            {loan.pk: [row.interest for row in self.schedule(loan)] for loan in self.loans},
+            pooled,
+        )
+
+    def test_payments_due_before_effective_date_keep_their_interest(self):
+        before = {loan.pk: self.schedule(loan) for loan in self.loans}
+        effective_date = date(2024, 4, 1)
+        services.reprice_loans(Decimal("0.18"), workers=1, effective_date=effective_date)
+        for loan in self.loans:
+            rows = self.schedule(loan)
+            self.assertEqual(loan.interest_rate, Decimal("0.18"))
+            self.assertEqual(
+                [row.due_date < effective_date for row in rows[1:3]], [True, False]
+            )
+            self.assertEqual(
+                [row.interest for row in rows[:2]],
+                [row.interest for row in before[loan.pk][:2]],
+            )
+            self.assertEqual(
+                [row.interest for row in rows[2:]],
+                [engine.quantize_money(row.balance * Decimal("0.015")) for row in rows[2:]],
+            )
+        self.assert_cashflow_consistent()
+
+    @override_settings(LOANS_ADJUST_BACKOFF=0)
+    def test_conflicting_chunk_is_repriced_again(self):
+        loan = self.loans[0]
+        before = self.schedule(loan)
+        original = services.read_repricing_chunk
+        reads = []
+
+        def read_then_adjust(loans, rate_of):
+            result = original(loans, rate_of)
+            if not reads:
+                adjust_payment(get_payment(loan.pk, 5), Decimal("10"))
+            reads.append(loans)
+            return result
+
+        with mock.patch.object(services, "read_repricing_chunk", read_then_adjust):
+            services.reprice_loans(Decimal("0.2"), workers=1, effective_date=self.effective_date)
+        self.assertEqual(len(reads), 2)
+        before[4].principal -= Decimal("20")
+        rows = self.schedule(loan)
+        self.assertEqual(rows[4].principal, before[4].principal)
+        self.assertEqual(loan.version, 3)
+        self.assert_repriced(loan, Decimal("0.2"), rows)
+        self.assert_cashflow_consistent()
+
+    def test_command_reprices_rate_table_and_resumes(self):
+        first, second, third, _ = self.loans
+        with tempfile.TemporaryDirectory() as directory:
+            rates = os.path.join(directory, "rates.csv")
+            with open(rates, "w") as handle:
+                handle.write(f"loan_id,interest_rate\n{first.pk},15\n{third.pk},0.2\n")
+            checkpoint = os.path.join(directory, "checkpoint.json")
+            with open(checkpoint, "w") as handle:
+                source = {"rates": rates, "effective_date": "2024-01-31"}
+                json.dump({"source": source, "last_loan_id": first.pk}, handle)
+            out = io.StringIO()
+            call_command(
+                "reprice_loans",
+                rates=rates,
+                workers=1,
+                checkpoint=checkpoint,
+                effective_date=self.effective_date,
+                stdout=out,
+            )
+            self.assertFalse(os.path.exists(checkpoint))
+
+            with self.assertRaises(CommandError):
+                call_command("reprice_loans", rate="abc", stdout=io.StringIO())
+        self.assertIn(f"Resuming after loan {first.pk}.", out.getvalue())
+        self.assertIn("Repriced 1 of 1 loans", out.getvalue())
+        rates = {
+            loan.pk: loan.interest_rate
+            for loan in Loan.objects.filter(pk__in=[first.pk, second.pk, third.pk])
+        }
+        self.assertEqual(
+            rates, {first.pk: Decimal("0.1"), second.pk: Decimal("0.1"), third.pk: Decimal("0.2")}
+        )
+
+
+class ImportExportCommandTest(TestCase):
+    loan = dict(
+        LOAN_PAYLOAD,
+        amount="2000",
+        loan_start_date="2024-03-31",
+        number_of_payments=5,
+        interest_rate="0.15",
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def stored_rows(self):
+        return [
+            (loan.pk, *row)
+            for loan in Loan.objects.order_by("pk")
+            for row in services.iter_schedule(loan)
+        ]
+
+    def test_import_validates_and_creates_in_batches(self):
+        path = self.path("loans.csv")
+        with open(path, "w", newline="") as handle:
+            writer = csv.DictWriter(handle, list(self.loan) + ["storage"])
+            writer.writeheader()
+            writer.writerow(self.loan)
+            writer.writerow(dict(self.loan, periodicity="1x"))
+            writer.writerow(dict(self.loan, interest_rate="12", storage="packed"))
+            writer.writerow(dict(self.loan, number_of_payments=3))
+        out, err = io.StringIO(), io.StringIO()
+        call_command("import_loans", path, batch_size=2, stdout=out, stderr=err)
+
+        self.assertIn("Imported 3 loans (1 invalid records)", out.getvalue())
+        self.assertIn("Line 3:", err.getvalue())
+        self.assertIn("periodicity", err.getvalue())
+        loans = list(Loan.objects.order_by("pk"))
+        self.assertEqual([loan.storage for loan in loans], ["rows", "packed", "rows"])
+        self.assertEqual(loans[1].interest_rate, Decimal("0.12"))
+        created = APIClient().post(reverse("loan-create"), data=self.loan, format="json")
+        self.assertEqual(
+            serialize_schedule(services.iter_schedule(loans[0])), created.data["schedule"]
+        )
+
+    def test_import_reports_broken_ndjson_lines(self):
+        path = self.path("loans.ndjson")
+        with open(path, "w") as handle:
+            handle.write(json.dumps(self.loan) + "\n{broken\n\n[1]\n")
+        out, err = io.StringIO(), io.StringIO()
+        call_command("import_loans", path, stdout=out, stderr=err)
+        self.assertIn("Imported 1 loans (2 invalid records)", out.getvalue())
+        self.assertIn("Line 2: NDJSON parse error", err.getvalue())
+        self.assertIn("Line 4: Expected a JSON object.", err.getvalue())
+
+    def test_export_streams_rows_and_packed_schedules_in_loan_order(self):
+        for storage in ("packed", "rows", "packed"):
+            create_loan(
+                loan_data(
+                    amount="900",
+                    loan_start_date="2024-01-31",
+                    interest_rate="0.2",
+                    storage=storage,
+                )
+            )
+        expected = [
+            {"loan_id": loan_id, **schedule_row_data(*row)}
+            for loan_id, *row in self.stored_rows()
+        ]
+
+        path = self.path("schedules.csv.gz")
+        out = io.StringIO()
+        call_command("export_schedules", path, chunk_size=3, stdout=out)
+        with gzip.open(path, "rt", newline="") as handle:
+            rows = list(csv.DictReader(handle))
+        self.assertEqual(
+            rows, [{key: str(value) for key, value in row.items()} for row in expected]
+        )
+        self.assertIn("Exported 12 payments", out.getvalue())
+
+        out, err = io.StringIO(), io.StringIO()
+        call_command("export_schedules", "-", format="ndjson", stdout=out, stderr=err)
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()], expected)
+        self.assertIn("Exported 12 payments", err.getvalue())
+
+
+class CompactScheduleFormatTest(TestCase):
+    payload = dict(
+        LOAN_PAYLOAD, amount="3000", number_of_payments=90, periodicity="1d", interest_rate="0.12"
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.created = self.client.post(reverse("loan-create"), data=self.payload, format="json")
+        self.loan_id = self.created.data["loan_id"]
+
+    def as_columns(self, schedule):
+        return {
+            "id": [row["id"] for row in schedule],
+            "date": [row["date"] for row in schedule],
+            "principal_cents": [int(Decimal(row["principal"]) * 100) for row in schedule],
+            "interest_cents": [int(Decimal(row["interest"]) * 100) for row in schedule],
+        }
+
+    def test_json_remains_the_default(self):
+        self.assertEqual(self.created["Content-Type"], "application/json")
+        self.assertIsInstance(self.created.data["schedule"], list)
+
+    def test_columnar_schedule_matches_json(self):
+        expected = self.as_columns(self.created.data["schedule"])
+        url = reverse("loan-schedule", args=[self.loan_id])
+        response = self.client.get(url, HTTP_ACCEPT="application/vnd.loans.columnar+json")
+        self.assertEqual(response["Content-Type"], "application/vnd.loans.columnar+json")
+        self.assertEqual(json.loads(response.content)["schedule"], expected)
+        self.assertLess(len(response.content), len(self.created.content) / 2)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, {"format": "columnar"})
+        self.assertEqual(cached.content, response.content)
+        self.assertNotEqual(cached["ETag"], self.client.get(url)["ETag"])
+
+        reduced = self.client.post(
+            reverse("payment-reduce", args=[self.loan_id, 89]) + "?format=columnar",
+            data={"reduction": "10", "since_version": 0},
+            format="json",
+        )
+        self.assertEqual(json.loads(reduced.content)["changes"]["id"], [89, 90])
+        refreshed = json.loads(self.client.get(url, {"format": "columnar"}).content)
+        changes = json.loads(reduced.content)["changes"]
+        self.assertEqual(refreshed["schedule"]["interest_cents"][88:], changes["interest_cents"])
+
+    @skipIf(renderers.msgpack is None, "msgpack is not installed")
+    def test_messagepack_schedule(self):
+        response = self.client.post(
+            reverse("loan-create"), data=self.payload, format="json",
+            HTTP_ACCEPT="application/msgpack",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = renderers.msgpack.unpackb(response.content)
+        self.assertEqual(data["schedule"], self.as_columns(self.created.data["schedule"]))
+        invalid = self.client.post(
+            reverse("loan-create"), data={}, format="json", HTTP_ACCEPT="application/msgpack"
+        )
+        self.assertIn("amount", renderers.msgpack.unpackb(invalid.content))
+
+    def test_gzip_compression(self):
+        url = reverse("loan-schedule", args=[self.loan_id])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertTrue(response["ETag"].startswith("W/"))
+        self.assertEqual(
+            json.loads(gzip.decompress(response.content)), json.loads(self.created.content)
+        )
+        streamed = self.client.get(url, {"format": "ndjson"}, HTTP_ACCEPT_ENCODING="gzip")
+        lines = gzip.decompress(b"".join(streamed.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 90)
+
+    @skipIf(compression.brotli is None, "brotli is not installed")
+    def test_brotli_is_preferred_when_accepted(self):
+        url = reverse("loan-schedule", args=[self.loan_id])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(
+            json.loads(compression.brotli.decompress(response.content)),
+            json.loads(self.created.content),
+        )
+        streamed = self.client.get(url, {"format": "ndjson"}, HTTP_ACCEPT_ENCODING="br")
+        body = compression.brotli.decompress(b"".join(streamed.streaming_content))
+        self.assertEqual(len(body.splitlines()), 90)
+
+    @skipIf(compression.brotli is None, "brotli is not installed")
+    def test_html_pages_are_not_brotli_compressed(self):
+        response = self.client.get("/admin/login/", HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertTrue(response["Content-Type"].startswith("text/html"))
+        self.assertEqual(response["Content-Encoding"], "gzip")
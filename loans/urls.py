@@ -1,12 +1,56 @@
 from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
 
-from .views import LoanScheduleCreateView, PaymentAdjustmentView
+from .async_views import (
+    AsyncLoanScheduleCreateView,
+    AsyncLoanScheduleView,
+    AsyncPaymentAdjustmentView,
+)
+from .views import (
+    CashflowView,
+    JobStatusView,
+    LoanBulkCreateView,
+    LoanQuoteView,
+    LoanScheduleCreateView,
+    LoanScheduleView,
+    PaymentAdjustmentView,
+    PaymentBatchAdjustmentView,
+)
 
 urlpatterns = [
     path("loans/", LoanScheduleCreateView.as_view(), name="loan-create"),
+    path(
+        "loans/<int:loan_id>/schedule/",
+        LoanScheduleView.as_view(),
+        name="loan-schedule",
+    ),
+    path("loans/quote/", LoanQuoteView.as_view(), name="loan-quote"),
+    path("loans/bulk/", LoanBulkCreateView.as_view(), name="loan-bulk-create"),
     path(
         "loans/<int:loan_id>/payments/<int:sequence>/reduce/",
         PaymentAdjustmentView.as_view(),
         name="payment-reduce",
     ),
+    path(
+        "payments/reduce/",
+        PaymentBatchAdjustmentView.as_view(),
+        name="payment-batch-reduce",
+    ),
+    path("jobs/<str:job_id>/", JobStatusView.as_view(), name="job-status"),
+    path("cashflow/", CashflowView.as_view(), name="cashflow"),
+    path(
+        "async/loans/",
+        csrf_exempt(AsyncLoanScheduleCreateView.as_view()),
+        name="async-loan-create",
+    ),
+    path(
+        "async/loans/<int:loan_id>/schedule/",
+        AsyncLoanScheduleView.as_view(),
+        name="async-loan-schedule",
+    ),
+    path(
+        "async/loans/<int:loan_id>/payments/<int:sequence>/reduce/",
+        csrf_exempt(AsyncPaymentAdjustmentView.as_view()),
+        name="async-payment-reduce",
+    ),
 ]
@@ -0,0 +1,144 @@
+"""Vectorized schedule generation for whole portfolios.
+
+Amounts are handled as integer cents and every loan advances one payment
+per NumPy step, so the Python-level loop runs ``max(number_of_payments)``
+times instead of once per payment. Interest and EMI are first estimated in
+floating point; values whose fractional cent lies too close to the rounding
+boundary to be trusted are recomputed with the Decimal engine, so results are
+identical to :func:`loans.engine.generate_schedule`.
+"""
+
+from decimal import Decimal
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from . import engine
+from .engine import ROUNDING_TOLERANCE, from_cents
+
+
+class PortfolioSchedule:
+    """Schedules of many loans stored as flat integer-cent columns.
+
+    Payments of loan ``j`` occupy ``offsets[j]:offsets[j + 1]`` in
+    ``principal_cents`` and ``interest_cents``.
+    """
+
+    __slots__ = ("emi_cents", "offsets", "principal_cents", "interest_cents")
+
+    def __init__(self, emi_cents, offsets, principal_cents, interest_cents):
+        self.emi_cents = emi_cents
+        self.offsets = offsets
+        self.principal_cents = principal_cents
+        self.interest_cents = interest_cents
+
+    def __len__(self) -> int:
+        return len(self.emi_cents)
+
+    def loan(self, index: int) -> List[Tuple[int, Decimal, Decimal]]:
+        """Return ``(sequence, principal, interest)`` rows of one loan."""
+
+        start, end = self.offsets[index], self.offsets[index + 1]
+        principals = self.principal_cents[start:end].tolist()
+        interests = self.interest_cents[start:end].tolist()
+        return [
+            (sequence, from_cents(principal), from_cents(interest))
+            for sequence, (principal, interest) in enumerate(zip(principals, interests), start=1)
+        ]
+
+
+def rates_per_period(interest_rates: Sequence, periodicities: Sequence[str]) -> List[Decimal]:
+    """Return the exact Decimal per-period rate of each loan, computed once per pair."""
+
+    rates = {}
+    result = []
+    for rate, periodicity in zip(interest_rates, periodicities):
+        key = (rate, periodicity)
+        if key not in rates:
+            year_fraction = engine.get_periodicity(periodicity).year_fraction
+            rates[key] = Decimal(str(rate)) * year_fraction
+        result.append(rates[key])
+    return result
+
+
+def _ambiguous(estimate: np.ndarray) -> np.ndarray:
+    fraction = estimate - np.floor(estimate)
+    tolerance = np.abs(estimate) * ROUNDING_TOLERANCE + ROUNDING_TOLERANCE
+    return np.abs(fraction - 0.5) < tolerance
+
+
+def _round_half_up(estimate: np.ndarray) -> np.ndarray:
+    return (np.sign(estimate) * np.floor(np.abs(estimate) + 0.5)).astype(np.int64)
+
+
+def calculate_emis(
+    amount_cents: np.ndarray, rates: List[Decimal], numbers_of_payments: np.ndarray
+) -> np.ndarray:
+    """Vectorized :func:`loans.engine.calculate_emi` in cents."""
+
+    i = np.array([float(rate) for rate in rates])
+    n = numbers_of_payments
+    emi = np.empty(len(amount_cents), dtype=np.int64)
+
+    zero = i == 0
+    # P / n with ROUND_HALF_UP is exact in integers.
+    emi[zero] = (2 * amount_cents[zero] + n[zero]) // (2 * n[zero])
+
+    positive = ~zero
+    ip = i[positive]
+    estimate = amount_cents[positive] * ip / -np.expm1(-n[positive] * np.log1p(ip))
+    emi[positive] = _round_half_up(estimate)
+
+    for index in np.flatnonzero(positive)[_ambiguous(estimate)]:
+        exact = engine.calculate_emi(
+            from_cents(int(amount_cents[index])), rates[index], int(n[index])
+        )
+        emi[index] = engine.to_cents(exact)
+    return emi
+
+
+def generate_schedules(
+    amounts: Sequence,
+    interest_rates: Sequence,
+    periodicities: Sequence[str],
+    numbers_of_payments: Sequence[int],
+) -> PortfolioSchedule:
+    """Compute EMI, principal and interest columns for every loan at once.
+
+    ``amounts`` and ``interest_rates`` accept anything ``Decimal(str(x))``
+    understands; rates are fractions (``0.1`` for 10%).
+    """
+
+    amount_cents = np.array(
+        [engine.to_cents(Decimal(str(amount))) for amount in amounts], dtype=np.int64
+    )
+    n = np.asarray(numbers_of_payments, dtype=np.int64)
+    rates = rates_per_period(interest_rates, periodicities)
+    i = np.array([float(rate) for rate in rates])
+
+    emi = calculate_emis(amount_cents, rates, n)
+    offsets = np.zeros(len(n) + 1, dtype=np.int64)
+    np.cumsum(n, out=offsets[1:])
+    principal_cents = np.empty(offsets[-1], dtype=np.int64)
+    interest_cents = np.empty(offsets[-1], dtype=np.int64)
+
+    remaining = amount_cents.copy()
+    for step in range(1, int(n.max(initial=0)) + 1):
+        active = np.flatnonzero(n >= step)
+        balance = remaining[active]
+
+        estimate = balance * i[active]
+        interest = _round_half_up(estimate)
+        for position in np.flatnonzero(_ambiguous(estimate)):
+            exact = engine.quantize_money(
+                from_cents(int(balance[position])) * rates[active[position]]
+            )
+            interest[position] = engine.to_cents(exact)
+
+        principal = np.where(n[active] == step, balance, emi[active] - interest)
+        slots = offsets[active] + step - 1
+        principal_cents[slots] = principal
+        interest_cents[slots] = interest
+        remaining[active] = balance - principal
+
+    return PortfolioSchedule(emi, offsets, principal_cents, interest_cents)
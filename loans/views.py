@@ -1,98 +1,259 @@
-from decimal import Decimal
+from collections import defaultdict
+from collections.abc import Iterable
 
+from django.http import (
+    HttpResponse,
+    HttpResponseNotModified,
+    QueryDict,
+    StreamingHttpResponse,
+)
 from django.db import transaction
+from django.utils.cache import patch_vary_headers
 from rest_framework import generics, status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
-from rest_framework.exceptions import NotFound
+from rest_framework.settings import api_settings
 
+from . import cashflow
+from .cache import etag_matches, get_cached_schedule, set_cached_schedule
+from .engine import from_cents
+from .instrumentation import span
+from .jobs import accepted_data, enqueue, get_job, needs_job
 from .models import Loan, Payment
-from .serializers import LoanCreateSerializer, PaymentAdjustmentSerializer, PaymentSerializer
+from .parsers import NDJSONParser
+from .renderers import (
+    SCHEDULE_VERSION_HEADER,
+    NDJSONRenderer,
+    compact_renderer_classes,
+    is_columnar,
+    render_schedule,
+    schedule_data,
+    schedule_delta_data,
+)
+from .serializers import (
+    CashflowQuerySerializer,
+    LoanCreateSerializer,
+    PaymentAdjustmentSerializer,
+    PaymentReductionItemSerializer,
+    serialize_schedule_rows,
+)
 from .services import (
-    adjust_payment,
-    get_period_length,
-    next_due_date,
-    quantize_money,
+    ScheduleConflict,
+    adjust_payments,
+    apply_reduction,
+    create_loan,
+    create_loans_bulk,
+    get_payment,
+    iter_schedule,
+    quote_schedule,
+    schedule_tuples,
 )
 
 
-class LoanScheduleCreateView(generics.CreateAPIView):
-    serializer_class = LoanCreateSerializer
-
+class ScheduleResponseMixin:
+    """Render a loan schedule as JSON, or stream it as NDJSON when negotiated.
 
-    def calculate_emi(self, loan):
-        P = Decimal(loan.amount)
-        r = Decimal(loan.interest_rate)
-        n = loan.number_of_payments
+    Clients opt into NDJSON with ``Accept: application/x-ndjson`` or
+    ``?format=ndjson``; the loan id then travels in the ``X-Loan-Id`` header.
+    ``?format=columnar`` (and ``?format=msgpack`` when ``msgpack`` is
+    installed) turn the schedule into parallel arrays with amounts in cents.
+    ``rows`` are ``(sequence, due_date, principal, interest)`` tuples, e.g.
+    the ones the view already has in hand or :func:`iter_schedule`. The loan
+    version, when known, is sent in the ``X-Schedule-Version`` header.
+    """
 
-        l = get_period_length(loan.periodicity)
-        i = r * l  # per-period interest
+    renderer_classes = (
+        api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer] + compact_renderer_classes()
+    )
 
-        if i == 0:
-            return quantize_money(P / n)
+    def schedule_response(self, loan_id, rows, response_status, version=None):
+        renderer = self.request.accepted_renderer
+        if isinstance(renderer, NDJSONRenderer):
+            response = StreamingHttpResponse(
+                renderer.stream_rows(rows),
+                content_type=renderer.media_type,
+                status=response_status,
+            )
+            response["X-Loan-Id"] = str(loan_id)
+        else:
+            with span("serialize"):
+                schedule = schedule_data(rows, renderer)
+            response = Response({"loan_id": loan_id, "schedule": schedule}, status=response_status)
+        if version is not None:
+            response[SCHEDULE_VERSION_HEADER] = str(version)
+        return response
 
-        emi = i * P / (1 - (1 + i) ** Decimal(-n))
-        return quantize_money(emi)
 
-    def create_payments(self, loan: Loan):
-        principal_remaining = Decimal(loan.amount)
-        start_date = loan.loan_start_date
-        payments = []
+def job_payload(data) -> dict:
+    """Flatten request data into a JSON-safe dict to store with a job.
 
-        emi = self.calculate_emi(loan)
-        l = get_period_length(loan.periodicity)
-        current_delta = next_due_date(loan.periodicity)
-        for idx in range(1, loan.number_of_payments + 1):
+    Form and multipart bodies arrive as a ``QueryDict``, whose ``dict()``
+    would turn every value into a list.
+    """
 
-            current_date = start_date + current_delta
-            start_date = current_date
-            i = Decimal(loan.interest_rate) * l
-            interest = quantize_money(principal_remaining * i)
+    return data.dict() if isinstance(data, QueryDict) else dict(data)
 
-            principal = quantize_money(emi - interest)
 
-            if idx == loan.number_of_payments:
-                principal = quantize_money(principal_remaining)
-                emi = quantize_money(principal + interest)
+def job_response(request, job):
+    """Answer ``202`` pointing at the status endpoint of a background job."""
 
-            payments.append(
-                Payment(
-                    loan=loan,
-                    sequence=idx,
-                    due_date=current_date,
-                    principal=principal,
-                    interest=interest,
-                )
-            )
+    data = accepted_data(request, job)
+    return Response(
+        data, status=status.HTTP_202_ACCEPTED, headers={"Location": data["status_url"]}
+    )
 
-            principal_remaining -= principal
 
-        Payment.objects.bulk_create(payments)
+class LoanScheduleCreateView(ScheduleResponseMixin, generics.CreateAPIView):
+    serializer_class = LoanCreateSerializer
 
     def perform_create(self, serializer):
-        with transaction.atomic():
-            loan = Loan.objects.create(**serializer.validated_data)
-            self.create_payments(loan)
-        return loan
+        return create_loan(serializer.validated_data)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        loan = self.perform_create(serializer)
-        schedule = PaymentSerializer(loan.payments.all(), many=True)
+        if needs_job(serializer.validated_data["number_of_payments"]):
+            job = enqueue("create_loan", job_payload(serializer.initial_data))
+            return job_response(request, job)
+        loan, payments = self.perform_create(serializer)
+        return self.schedule_response(
+            loan.pk, schedule_tuples(payments), status.HTTP_201_CREATED, loan.version
+        )
+
+
+class LoanScheduleView(ScheduleResponseMixin, generics.GenericAPIView):
+    """Read a loan's schedule.
+
+    The rendered JSON is cached until the schedule changes and carries an
+    ``ETag``, so repeated reads cost a cache lookup or a ``304``; the
+    columnar formats are cached separately. NDJSON streaming bypasses the
+    cache. All carry the ``X-Schedule-Version`` a later adjustment can be
+    sent as ``since_version``.
+    """
+
+    def get(self, request, loan_id: int, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if isinstance(renderer, NDJSONRenderer):
+            loan = self.get_loan(loan_id)
+            return self.schedule_response(
+                loan_id, iter_schedule(loan), status.HTTP_200_OK, loan.version
+            )
+
+        if is_columnar(renderer):
+            schedule_format, content_type = renderer.format, renderer.media_type
+        else:
+            schedule_format, content_type = "json", "application/json"
+        cached = get_cached_schedule(loan_id, schedule_format)
+        if cached is None:
+            # One transaction, so the rows match the version they are cached under.
+            with transaction.atomic():
+                loan = self.get_loan(loan_id)
+                with span("serialize"):
+                    body = render_schedule(renderer, loan_id, iter_schedule(loan))
+            version = loan.version
+            etag = set_cached_schedule(loan_id, body, version, schedule_format)
+        else:
+            etag, body, version = cached
+
+        if etag_matches(etag, request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type=content_type)
+        response["ETag"] = etag
+        response[SCHEDULE_VERSION_HEADER] = str(version)
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+    def get_loan(self, loan_id: int) -> Loan:
+        try:
+            return Loan.objects.get(pk=loan_id)
+        except Loan.DoesNotExist as exc:
+            raise NotFound("Loan not found.") from exc
+
+
+class LoanQuoteView(generics.GenericAPIView):
+    """Preview a schedule without creating a loan."""
+
+    serializer_class = LoanCreateSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        rows = quote_schedule(
+            data["amount"],
+            data["interest_rate"],
+            data["periodicity"],
+            data["number_of_payments"],
+            data["loan_start_date"],
+        )
+        with span("serialize"):
+            schedule = serialize_schedule_rows(rows)
+        return Response({"schedule": schedule}, status=status.HTTP_200_OK)
+
+
+class LoanBulkCreateView(generics.GenericAPIView):
+    """Create many loans from a JSON array or an NDJSON stream."""
+
+    serializer_class = LoanCreateSerializer
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if isinstance(items, (dict, str)) or not isinstance(items, Iterable):
+            raise ValidationError({"detail": "Expected a list of loans."})
+
+        results = []
+        valid_data = []
+        valid_results = []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                result = {"index": index}
+                valid_data.append(serializer.validated_data)
+                valid_results.append(result)
+            else:
+                result = {"index": index, "errors": serializer.errors}
+            results.append(result)
+
+        if not results:
+            raise ValidationError({"detail": "Expected a non-empty list of loans."})
+
+        loans = create_loans_bulk(valid_data)
+        for result, loan in zip(valid_results, loans):
+            result["loan_id"] = loan.id
+
+        if not loans:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(loans) < len(results):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
         return Response(
-            {"loan_id": loan.id, "schedule": schedule.data},
-            status=status.HTTP_201_CREATED,
+            {
+                "created": len(loans),
+                "failed": len(results) - len(loans),
+                "results": results,
+            },
+            status=response_status,
         )
 
 
-class PaymentAdjustmentView(generics.GenericAPIView):
+class PaymentAdjustmentView(ScheduleResponseMixin, generics.GenericAPIView):
+    """Reduce a payment's principal and answer with the recalculated schedule.
+
+    A client holding a cached copy may send the ``since_version`` it has;
+    when that is the version the adjustment was applied to, only the
+    changed rows come back as ``changes`` together with the new
+    ``version``. A stale version (or NDJSON) gets the full schedule.
+    """
+
     serializer_class = PaymentAdjustmentSerializer
 
     def get_payment(self, loan_id: int, sequence: int) -> Payment:
         try:
-            return Payment.objects.select_related("loan").get(
-                loan_id=loan_id, sequence=sequence
-            )
+            return get_payment(loan_id, sequence)
         except Payment.DoesNotExist as exc:
             raise NotFound("Payment not found for provided identifiers") from exc
 
@@ -100,9 +261,107 @@ class PaymentAdjustmentView(generics.GenericAPIView):
         payment = self.get_payment(loan_id, sequence)
         serializer = self.get_serializer(data=request.data, context={"payment": payment})
         serializer.is_valid(raise_exception=True)
-        adjust_payment(payment, serializer.validated_data["reduction"])
-        schedule = PaymentSerializer(payment.loan.payments.all(), many=True)
+        reduction = serializer.validated_data["reduction"]
+        if needs_job(payment.loan.number_of_payments):
+            job = enqueue(
+                "adjust_payment",
+                {"loan_id": loan_id, "sequence": sequence, "reduction": str(reduction)},
+            )
+            return job_response(request, job)
+        update = apply_reduction(payment, reduction)
+        since_version = serializer.validated_data.get("since_version")
+        if since_version == update.base_version and not isinstance(
+            request.accepted_renderer, NDJSONRenderer
+        ):
+            with span("serialize"):
+                data = schedule_delta_data(update, request.accepted_renderer)
+            response = Response(data, status=status.HTTP_200_OK)
+            response[SCHEDULE_VERSION_HEADER] = str(update.version)
+            return response
+        return self.schedule_response(
+            payment.loan_id, update.rows, status.HTTP_200_OK, update.version
+        )
+
+
+class PaymentBatchAdjustmentView(generics.GenericAPIView):
+    """Apply a list of principal reductions across one or many loans.
+
+    Reductions are grouped by loan and every affected schedule is
+    recalculated once, in its own transaction, so one invalid loan does not
+    roll back the others.
+    """
+
+    serializer_class = PaymentReductionItemSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+
+        reductions_by_loan = defaultdict(list)
+        for item in serializer.validated_data:
+            reductions_by_loan[item["loan_id"]].append((item["sequence"], item["reduction"]))
+
+        results = []
+        failed = 0
+        for loan_id, reductions in reductions_by_loan.items():
+            try:
+                changed = adjust_payments(loan_id, reductions)
+            except (ValidationError, ScheduleConflict) as exc:
+                failed += 1
+                results.append({"loan_id": loan_id, "errors": exc.detail})
+            else:
+                results.append(
+                    {
+                        "loan_id": loan_id,
+                        "applied": len(reductions),
+                        "changed_payments": len(changed),
+                    }
+                )
+
+        if failed == len(results):
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif failed:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_200_OK
+        return Response({"results": results}, status=response_status)
+
+
+class JobStatusView(generics.GenericAPIView):
+    """Report a background job; finished jobs include the schedule as ``result``."""
+
+    def get(self, request, job_id: str, *args, **kwargs):
+        job = get_job(job_id)
+        if job is None:
+            raise NotFound("Job not found.")
+        data = {key: value for key, value in job.items() if key != "payload"}
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class CashflowView(generics.GenericAPIView):
+    """Expected principal and interest due per day or month across all loans."""
+
+    serializer_class = CashflowQuerySerializer
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        periods = cashflow.cashflow(query["from"], query["to"], query["bucket"])
+        results = [
+            {
+                "period": period.isoformat(),
+                "principal": format(from_cents(principal), "f"),
+                "interest": format(from_cents(interest), "f"),
+            }
+            for period, principal, interest in periods
+        ]
         return Response(
-            {"loan_id": payment.loan_id, "schedule": schedule.data},
+            {
+                "from": query["from"].isoformat(),
+                "to": query["to"].isoformat(),
+                "bucket": query["bucket"],
+                "results": results,
+            },
             status=status.HTTP_200_OK,
         )